@@ -0,0 +1,132 @@
+"""Seeds a world with locations and times the bounding-box query.
+
+Inserts a world with `--locations` locations spread over a square map,
+then for boxes covering a growing share of the map runs the first page of
+GET /worlds/{id}/locations?bbox= the way the endpoint does: EXPLAIN
+(ANALYZE, BUFFERS) of the statement and the wall time of running and
+rendering it. Everything is rolled back unless `--keep` is passed. Run it
+against a database migrated to head, so the GiST index exists.
+
+    python -m app.commands.bench_bbox --locations 100000 --runs 20
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+import uuid
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models, schemas
+from app.commands.bench_search import explain
+from app.config import config
+from app.controllers.database import async_session, engine
+from app.controllers.loading import get_location_out_options
+from app.controllers.pagination import paginate
+from app.controllers.spatial import get_bbox_filter
+
+
+logger = logging.getLogger(__name__)
+
+MAP_SIZE = 10_000.0
+
+# Share of the map area each benchmarked box covers
+BOX_AREAS = (0.0001, 0.01, 0.1, 1.0)
+
+SEED_LOCATIONS = sa.text("""
+    INSERT INTO locations (id, name, world_id, coord_x, coord_y, created_at)
+    SELECT
+        md5(random()::text || i)::uuid,
+        'Location ' || i,
+        CAST(:world_id AS uuid),
+        random() * CAST(:map_size AS float8),
+        random() * CAST(:map_size AS float8),
+        NOW() - make_interval(secs => i)
+    FROM generate_series(1, CAST(:count AS int)) AS i
+""")
+
+
+async def seed_world(db: AsyncSession, locations: int) -> uuid.UUID:
+    world_id = uuid.uuid4()
+
+    await db.execute(sa.insert(models.World).values(id=world_id, name='Bench bbox', map_image='bench.png'))
+    await db.execute(SEED_LOCATIONS, {'world_id': str(world_id), 'map_size': MAP_SIZE, 'count': locations})
+    await db.execute(sa.text('ANALYZE locations'))
+
+    return world_id
+
+
+def get_bbox_statement(world_id: uuid.UUID, bbox: tuple[float, float, float, float]):
+    """The statement GET /worlds/{id}/locations?bbox= runs for the first page"""
+
+    statement = (
+        sa.select(models.Location)
+        .where(models.Location.world_id == world_id, get_bbox_filter(bbox))
+        .options(*get_location_out_options(None, set()))
+    )
+
+    return paginate(statement, (models.Location.created_at, models.Location.id), config.PAGINATION_DEFAULT_LIMIT)
+
+
+async def time_bbox_page(db: AsyncSession, statement, runs: int) -> list[float]:
+    timings = []
+
+    for _ in range(runs):
+        db.expunge_all()
+        started_at = time.perf_counter()
+
+        query = await db.execute(statement)
+        [schemas.LocationSparse.from_orm(location).json(exclude_unset=True) for location in query.scalars().all()]
+
+        timings.append(time.perf_counter() - started_at)
+
+    return timings
+
+
+async def run(locations: int, runs: int, keep: bool):
+    try:
+        async with async_session() as db:
+            started_at = time.perf_counter()
+            world_id = await seed_world(db, locations)
+            logger.info('seeding %d locations took %.1fs', locations, time.perf_counter() - started_at)
+
+            for area in BOX_AREAS:
+                side = MAP_SIZE * area ** 0.5
+                origin = (MAP_SIZE - side) / 2
+                statement = get_bbox_statement(world_id, (origin, origin, origin + side, origin + side))
+
+                plan = '\n'.join(await explain(db, statement))
+                timings = await time_bbox_page(db, statement, runs)
+
+                logger.info(
+                    'box over %g%% of the map: median %.2fms, max %.2fms\n%s',
+                    area * 100,
+                    statistics.median(timings) * 1000,
+                    max(timings) * 1000,
+                    plan
+                )
+
+            if keep:
+                await db.commit()
+            else:
+                await db.rollback()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--locations', type=int, default=100_000, help='locations of the seeded world')
+    parser.add_argument('--runs', type=int, default=20, help='timed runs per box')
+    parser.add_argument('--keep', action='store_true', help='commit the seeded world instead of rolling it back')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    asyncio.run(run(args.locations, max(args.runs, 1), args.keep))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Seeds worlds and compares the world search with the LIKE search it replaced.
+
+Inserts `--rows` worlds with generated names and descriptions. For every
+term, runs the first page of GET /worlds/?search= and the old query, an
+OR of case-sensitive LIKE '%term%' filters, on the same rows. Prints the
+median and max latency of both over `--runs` runs and their EXPLAIN
+(ANALYZE, BUFFERS), then rolls everything back, unless `--keep` is
+passed. Run it against a database migrated to head, so the pg_trgm
+indexes exist.
+
+    python -m app.commands.bench_search --rows 1000000 --term dragon --term sea --term ea
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.config import config
+from app.controllers.database import async_session, engine
+from app.controllers.loading import get_world_out_options
+from app.controllers.pagination import paginate
+from app.controllers.search import get_search_filter, get_search_relevance
+
+
+logger = logging.getLogger(__name__)
+
+SEED_CHUNK_SIZE = 100_000
+
+WORDS = [
+    'ancient', 'ash', 'bay', 'black', 'bridge', 'castle', 'cliff', 'cove', 'crown', 'dragon',
+    'dune', 'east', 'ember', 'fall', 'fen', 'forest', 'fort', 'frost', 'gate', 'glade',
+    'golden', 'harbor', 'haven', 'hill', 'hollow', 'iron', 'isle', 'keep', 'lake', 'marsh',
+    'mist', 'moon', 'north', 'oak', 'peak', 'pine', 'port', 'raven', 'red', 'river',
+    'rock', 'sea', 'shadow', 'silver', 'south', 'spire', 'star', 'stone', 'storm', 'sun',
+    'thorn', 'tower', 'vale', 'west', 'white', 'wind', 'winter', 'wolf', 'wood', 'wyrm',
+]
+
+
+# Every world gets a name of 2 and a description of 8 random words; the
+# series in the subquery is correlated so the words are drawn per row
+SEED_WORLDS = sa.text("""
+    WITH words AS (SELECT CAST(:words AS text[]) AS w, CAST(:word_count AS int) AS n)
+    INSERT INTO worlds (id, name, description, map_image, created_at)
+    SELECT
+        md5(random()::text || i)::uuid,
+        w[1 + floor(random() * n)::int] || ' ' || w[1 + floor(random() * n)::int],
+        array_to_string(ARRAY(
+            SELECT w[1 + floor(random() * n)::int]
+            FROM generate_series(1, 8 + i * 0)
+        ), ' '),
+        'bench.png',
+        NOW() - make_interval(secs => CAST(:start AS int) + i)
+    FROM words, generate_series(1, CAST(:count AS int)) AS i
+""")
+
+
+async def seed_worlds(db: AsyncSession, rows: int):
+    for start in range(0, rows, SEED_CHUNK_SIZE):
+        count = min(SEED_CHUNK_SIZE, rows - start)
+
+        await db.execute(SEED_WORLDS, {'words': WORDS, 'word_count': len(WORDS), 'start': start, 'count': count})
+        logger.info('seeded %d worlds', start + count)
+
+    await db.execute(sa.text('ANALYZE worlds'))
+
+
+def get_search_statement(search: str):
+    """The statement GET /worlds/?search= runs for the first page"""
+
+    columns = (models.World.name, models.World.description)
+    relevance = get_search_relevance(columns, search)
+    statement = (
+        sa.select(models.World, relevance)
+        .where(get_search_filter(columns, search))
+        .options(*get_world_out_options(None, set()))
+    )
+
+    return paginate(statement, (relevance, models.World.created_at, models.World.id), config.PAGINATION_DEFAULT_LIMIT, None, None)
+
+
+def get_like_statement(search: str):
+    """The statement GET /worlds/?search= ran before the trigram search.
+
+    That endpoint had no default limit, the benchmark fetches the same
+    page size so only the filter and the ordering differ.
+    """
+
+    return (
+        sa.select(models.World)
+        .where(sa.or_(models.World.name.contains(search), models.World.description.contains(search)))
+        .options(*get_world_out_options(None, set()))
+        .limit(config.PAGINATION_DEFAULT_LIMIT)
+    )
+
+
+async def explain(db: AsyncSession, statement) -> list[str]:
+    """EXPLAIN (ANALYZE, BUFFERS) of a statement, compiled as the app would send it"""
+
+    compiled = statement.compile(dialect=engine.dialect)
+    parameters = tuple(compiled.params[name] for name in compiled.positiontup)
+
+    connection = await db.connection()
+    query = await connection.exec_driver_sql(f'EXPLAIN (ANALYZE, BUFFERS) {compiled}', parameters)
+
+    return query.scalars().all()
+
+
+async def time_statement(db: AsyncSession, statement, runs: int) -> list[float]:
+    timings = []
+
+    for _ in range(runs):
+        db.expunge_all()
+        started_at = time.perf_counter()
+
+        query = await db.execute(statement)
+        query.all()
+
+        timings.append(time.perf_counter() - started_at)
+
+    return timings
+
+
+async def run(rows: int, terms: list[str], runs: int, keep: bool):
+    try:
+        async with async_session() as db:
+            started_at = time.perf_counter()
+            await seed_worlds(db, rows)
+            logger.info('seeding took %.1fs', time.perf_counter() - started_at)
+
+            for term in terms:
+                like_statement = get_like_statement(term)
+                search_statement = get_search_statement(term)
+
+                like_timings = await time_statement(db, like_statement, runs)
+                search_timings = await time_statement(db, search_statement, runs)
+
+                logger.info(
+                    'search=%r: LIKE median %.2fms, max %.2fms; trigram median %.2fms, max %.2fms\n'
+                    'LIKE plan:\n%s\ntrigram plan:\n%s',
+                    term,
+                    statistics.median(like_timings) * 1000,
+                    max(like_timings) * 1000,
+                    statistics.median(search_timings) * 1000,
+                    max(search_timings) * 1000,
+                    '\n'.join(await explain(db, like_statement)),
+                    '\n'.join(await explain(db, search_statement))
+                )
+
+            if keep:
+                await db.commit()
+            else:
+                await db.rollback()
+    finally:
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000, help='worlds to insert')
+    parser.add_argument('--term', action='append', dest='terms', help='search term to benchmark, can be repeated')
+    parser.add_argument('--runs', type=int, default=10, help='timed runs per term and query')
+    parser.add_argument('--keep', action='store_true', help='commit the seeded worlds instead of rolling them back')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    asyncio.run(run(args.rows, args.terms or ['dragon', 'sea', 'ea'], max(args.runs, 1), args.keep))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Deletes uploaded files that no world, location or user references.
+
+Meant to be run periodically, e.g. from a systemd timer. Defaults come
+from the FILE_CLEANUP_* settings.
+
+    python -m app.commands.collect_files --dry-run
+"""
+import argparse
+import asyncio
+import logging
+from datetime import timedelta
+
+from app.config import config
+from app.controllers.cleanup import collect_orphan_files
+from app.controllers.database import async_session, engine
+
+
+logger = logging.getLogger(__name__)
+
+
+async def run(grace_hours: int, batch_size: int, pause: float, dry_run: bool):
+    try:
+        async with async_session() as db:
+            report = await collect_orphan_files(
+                db,
+                timedelta(hours=grace_hours),
+                batch_size,
+                pause,
+                dry_run
+            )
+    finally:
+        await engine.dispose()
+
+    logger.info(
+        '%s %d files, %d bytes',
+        'would reclaim' if dry_run else 'reclaimed',
+        report.files,
+        report.bytes
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--grace-hours', type=int, default=config.FILE_CLEANUP_GRACE_HOURS, help='only files uploaded earlier than this')
+    parser.add_argument('--batch-size', type=int, default=config.FILE_CLEANUP_BATCH_SIZE, help='files deleted per transaction')
+    parser.add_argument('--pause', type=float, default=config.FILE_CLEANUP_PAUSE_SECONDS, help='seconds to sleep after each batch')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be deleted')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    asyncio.run(run(args.grace_hours, args.batch_size, args.pause, args.dry_run))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Counts the statements and rows of the world and location endpoints.
+
+Seeds two worlds, one with `--locations` locations and one with twice as
+many, every location with a creator and `--images` images. Calls the
+handlers of GET /worlds/?search=, GET /worlds/{id} and GET /locations/{id}
+for every `expand` on the seeding session, recording the rows every
+statement returned with an after_cursor_execute listener, and rolls the
+seed back.
+
+Every loaded relationship must take one statement per SELECTIN_CHUNK_SIZE
+parents and return one row per related row, so the rows of both worlds
+grow linearly with their locations; a join multiplying the rows or a load
+per location is a mismatch. Rendering without loader options must raise
+instead of lazy loading, as relationships are lazy='raise_on_sql'. Exits
+with status 1 on a mismatch.
+
+    python -m app.commands.count_queries --locations 200 --images 3
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import uuid
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from fastapi import Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models, schemas
+from app.controllers.database import async_session, engine
+from app.controllers.loading import LOCATION_EXPANSIONS, WORLD_EXPANSIONS
+from app.controllers.response_cache import location_tag, response_cache, world_tag
+from app.views.locations import get_location
+from app.views.worlds import get_all_worlds, get_world
+
+
+logger = logging.getLogger(__name__)
+
+# selectinload sends one SELECT ... IN per this many parents
+SELECTIN_CHUNK_SIZE = 500
+
+# None is an omitted expand, which expands everything
+WORLD_EXPANDS = ('', 'creator', 'locations', 'creator,locations', 'locations,images', None)
+LOCATION_EXPANDS = ('', 'creator', 'images', None)
+
+
+class SeededWorld(NamedTuple):
+    id: uuid.UUID
+    name: str
+    location_id: uuid.UUID
+    locations: int
+
+
+class QueryCounter:
+    """Rows returned by every statement sent to the database"""
+
+    def __init__(self):
+        self.rows: list[int] = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        # asyncpg reports the rowcount of a SELECT from SQLAlchemy 1.4.47 on,
+        # before that the rows buffered by the cursor adapter are counted
+        self.rows.append(cursor.rowcount if cursor.rowcount >= 0 else len(cursor._rows))
+
+
+async def seed_worlds(db: AsyncSession, locations: int, images: int) -> list[SeededWorld]:
+    """Inserts a world with `locations` locations and one with twice as many"""
+
+    suffix = uuid.uuid4().hex
+    user = models.User(
+        username=f'count-queries-{suffix}',
+        first_name='Count',
+        last_name='Queries',
+        email=f'count-queries-{suffix}@example.com',
+        password='-'
+    )
+    db.add(user)
+    await db.flush()
+
+    filenames = [f'count-queries-{suffix}-{i}.png' for i in range(images)]
+    if filenames:
+        await db.execute(sa.insert(models.File), [{'filename': filename, 'author_id': user.id} for filename in filenames])
+
+    worlds = []
+
+    for label, count in (('a', locations), ('b', 2 * locations)):
+        world_id = uuid.uuid4()
+        name = f'count-queries-{suffix}-{label}'
+        await db.execute(sa.insert(models.World).values(id=world_id, name=name, map_image='map.png', creator_id=user.id))
+
+        location_ids = [uuid.uuid4() for _ in range(count)]
+        await db.execute(
+            sa.insert(models.Location),
+            [
+                {'id': id, 'name': f'L{i}', 'world_id': world_id, 'creator_id': user.id, 'coord_x': i, 'coord_y': i}
+                for i, id in enumerate(location_ids)
+            ]
+        )
+        if filenames:
+            await db.execute(
+                sa.insert(models.LocationImage),
+                [{'image': filename, 'location_id': id} for id in location_ids for filename in filenames]
+            )
+
+        worlds.append(SeededWorld(world_id, name, location_ids[0], count))
+
+    return worlds
+
+
+def parse_expand(expand: str | None) -> set[str] | None:
+    return None if expand is None else {item for item in expand.split(',') if item}
+
+
+def get_expected_world_rows(expand: str | None, locations: int, images: int) -> list[int]:
+    """Rows of every statement: the world with its creator joined, then its
+    locations with theirs, then their images per SELECTIN_CHUNK_SIZE locations
+    """
+
+    expand = set(WORLD_EXPANSIONS) if expand is None else parse_expand(expand)
+    rows = [1]
+
+    if 'locations' in expand:
+        rows.append(locations)
+        if 'images' in expand:
+            rows.extend(
+                min(SELECTIN_CHUNK_SIZE, locations - start) * images
+                for start in range(0, locations, SELECTIN_CHUNK_SIZE)
+            )
+
+    return rows
+
+
+def get_expected_location_rows(expand: str | None, images: int) -> list[int]:
+    """Rows of every statement: the location with its creator joined, then its images"""
+
+    expand = set(LOCATION_EXPANSIONS) if expand is None else parse_expand(expand)
+
+    return [1, images] if 'images' in expand else [1]
+
+
+def get_request() -> Request:
+    return Request({'type': 'http', 'method': 'GET', 'headers': []})
+
+
+async def count_rows(db: AsyncSession, counter: QueryCounter, call) -> list[int]:
+    """Rows of every statement `call` sends, with nothing loaded in the session"""
+
+    db.expunge_all()
+    counter.rows = []
+
+    await call()
+
+    return counter.rows
+
+
+def is_expected(endpoint: str, expand: str | None, counted: list[int], expected: list[int]) -> bool:
+    ok = counted == expected
+    log = logger.info if ok else logger.error
+    log(
+        '%s expand=%s: %d statements returning %s rows (%d in total), expected %d returning %s (%d)',
+        endpoint, expand, len(counted), counted, sum(counted), len(expected), expected, sum(expected)
+    )
+
+    return ok
+
+
+async def check_world(db: AsyncSession, counter: QueryCounter, world: SeededWorld, images: int) -> bool:
+    ok = True
+
+    for expand in WORLD_EXPANDS:
+        async def list_worlds():
+            page = await get_all_worlds(
+                response=Response(),
+                db=db,
+                user_id=None,
+                search=world.name,
+                limit=None,
+                offset=None,
+                cursor=None,
+                fields=None,
+                expand=expand
+            )
+            if [world_out.id for world_out in page] != [world.id]:
+                raise AssertionError(f'searching {world.name!r} did not return only its world')
+            [world_out.json(exclude_unset=True) for world_out in page]
+
+        async def read_world():
+            response = await get_world(id=world.id, request=get_request(), db=db, fields=None, expand=expand)
+            if response.status_code != 200:
+                raise AssertionError(f'GET /worlds/{world.id} returned {response.status_code}')
+
+        rows = get_expected_world_rows(expand, world.locations, images)
+        ok &= is_expected(f'GET /worlds/?search= ({world.locations} locations)', expand, await count_rows(db, counter, list_worlds), rows)
+        ok &= is_expected(f'GET /worlds/{{id}} ({world.locations} locations)', expand, await count_rows(db, counter, read_world), rows)
+
+    for expand in LOCATION_EXPANDS:
+        async def read_location():
+            response = await get_location(id=world.location_id, request=get_request(), db=db, fields=None, expand=expand)
+            if response.status_code != 200:
+                raise AssertionError(f'GET /locations/{world.location_id} returned {response.status_code}')
+
+        rows = get_expected_location_rows(expand, images)
+        ok &= is_expected('GET /locations/{id}', expand, await count_rows(db, counter, read_location), rows)
+
+    return ok
+
+
+async def check_unloaded(db: AsyncSession, counter: QueryCounter, world: SeededWorld) -> bool:
+    async def render_unloaded():
+        query = await db.execute(sa.select(models.World).where(models.World.id == world.id))
+        try:
+            schemas.WorldOut.from_orm(query.scalars().first())
+        except sa.exc.InvalidRequestError:
+            return
+        raise AssertionError('rendering unloaded relationships did not raise')
+
+    statements = len(await count_rows(db, counter, render_unloaded))
+    logger.info('world without loader options: raised after %d statements, expected 1', statements)
+
+    return statements == 1
+
+
+async def run(locations: int, images: int) -> bool:
+    counter = QueryCounter()
+    worlds = []
+
+    try:
+        async with async_session() as db:
+            worlds = await seed_worlds(db, locations, images)
+
+            sa.event.listen(engine.sync_engine, 'after_cursor_execute', counter)
+            try:
+                ok = True
+                for world in worlds:
+                    ok &= await check_world(db, counter, world, images)
+                ok &= await check_unloaded(db, counter, worlds[0])
+            except AssertionError as e:
+                logger.error('%s', e)
+                ok = False
+            finally:
+                sa.event.remove(engine.sync_engine, 'after_cursor_execute', counter)
+
+            await db.rollback()
+    finally:
+        # The rendered responses of the rolled back worlds were cached
+        tags = [tag for world in worlds for tag in (world_tag(world.id), location_tag(world.location_id))]
+        if tags:
+            await response_cache.invalidate(*tags)
+        await engine.dispose()
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--locations', type=int, default=200, help='locations of the smaller seeded world')
+    parser.add_argument('--images', type=int, default=3, help='images of every location')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    if not asyncio.run(run(max(args.locations, 1), max(args.images, 0))):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Recounts the favourites of every world and fixes drifted counters.
+
+Meant to be run periodically, e.g. from a systemd timer.
+
+    python -m app.commands.reconcile_favourites --batch-size 1000
+"""
+import argparse
+import asyncio
+import logging
+
+from app.controllers.database import async_session, engine
+from app.controllers.popularity import reconcile_favourite_counts
+
+
+logger = logging.getLogger(__name__)
+
+
+async def run(batch_size: int):
+    try:
+        async with async_session() as db:
+            fixed = await reconcile_favourite_counts(db, batch_size)
+    finally:
+        await engine.dispose()
+
+    logger.info('fixed the favourite count of %d worlds', fixed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=1000, help='worlds recounted per transaction')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    asyncio.run(run(args.batch_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Moves files from the flat `static/` layout into the sharded one.
+
+Tile pyramids in `static/tiles` are moved along. Safe to run while the
+app is serving: each file or pyramid is moved with a single rename, and
+readers look for it in both layouts. Public filenames do not change. Can
+be interrupted and run again at any time. Resized variants are not moved;
+they are rendered again in the sharded layout and the old ones evicted.
+
+    python -m app.commands.shard_static --batch-size 1000 --pause 0.5
+"""
+import argparse
+import itertools
+import logging
+import os
+import shutil
+import time
+
+from app.controllers.storage import STATIC_DIR, get_file_path
+from app.controllers.tiles import TILES_DIR, get_tiles_dir
+
+
+logger = logging.getLogger(__name__)
+
+
+def iter_legacy_files(directory: str):
+    """Yields the names of uploads still stored directly in `directory`"""
+
+    with os.scandir(directory) as it:
+        for entry in it:
+            # Dot files are uploads in progress
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                yield entry.name
+
+
+def iter_legacy_tile_dirs(directory: str):
+    """Yields the names of the files whose pyramid is still directly in `directory`"""
+
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                # Shard directories have no extension, dot directories are pyramids in progress
+                if entry.is_dir(follow_symlinks=False) and '.' in entry.name and not entry.name.startswith('.'):
+                    yield entry.name
+    except FileNotFoundError:
+        return
+
+
+def shard_tiles(filename: str) -> bool:
+    """Moves the pyramid of one file into its shard, returns False if it was already gone"""
+
+    destination = get_tiles_dir(filename)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+    try:
+        os.rename(os.path.join(TILES_DIR, filename), destination)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # The pyramid was generated again in its shard meanwhile
+        if not os.path.isdir(destination):
+            raise
+        shutil.rmtree(os.path.join(TILES_DIR, filename), ignore_errors=True)
+
+    return True
+
+
+def shard_file(filename: str) -> bool:
+    """Moves one file into its shard, returns False if it was already gone"""
+
+    destination = get_file_path(filename)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+    try:
+        # Names are uuid- or content-addressed, so replacing a copy that
+        # was stored in the meantime keeps the same bytes
+        os.replace(os.path.join(STATIC_DIR, filename), destination)
+    except FileNotFoundError:
+        return False
+
+    return True
+
+
+def shard_static(batch_size: int, pause: float, dry_run: bool = False) -> int:
+    """Moves the legacy files in batches, sleeping `pause` seconds in between"""
+
+    moved = 0
+    batch = 0
+
+    legacy = itertools.chain(
+        ((shard_file, get_file_path, filename) for filename in iter_legacy_files(STATIC_DIR)),
+        ((shard_tiles, get_tiles_dir, filename) for filename in iter_legacy_tile_dirs(TILES_DIR)),
+    )
+
+    for move, get_destination, filename in legacy:
+        if dry_run:
+            logger.info('would move %s to %s', filename, get_destination(filename))
+            moved += 1
+            continue
+
+        if move(filename):
+            moved += 1
+            batch += 1
+
+        if batch >= batch_size:
+            logger.info('moved %d files', moved)
+            batch = 0
+            time.sleep(pause)
+
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=1000, help='files moved between pauses')
+    parser.add_argument('--pause', type=float, default=0.5, help='seconds to sleep after each batch')
+    parser.add_argument('--dry-run', action='store_true', help='only list the files that would be moved')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+
+    moved = shard_static(args.batch_size, args.pause, args.dry_run)
+    logger.info('%s %d files', 'would move' if args.dry_run else 'moved', moved)
+
+
+if __name__ == '__main__':
+    main()
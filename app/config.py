@@ -11,6 +11,53 @@ class Config(BaseSettings):
     JWT_ALGORITHM: str
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int
     STATIC_STORAGE_BASE_URL: str
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT_SECONDS: float = 30
+    DB_POOL_RECYCLE_SECONDS: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    DB_SLOW_QUERY_SECONDS: float = 0.5
+    DB_SLOW_QUERY_SAMPLE_RATE: float = 0.1
+    DB_REPLICA_HOSTS: str | None = None
+    DB_READ_YOUR_WRITES_SECONDS: float = 5
+    PAGINATION_DEFAULT_LIMIT: int = 50
+    PAGINATION_MAX_LIMIT: int = 200
+    LOCATION_INDEX_MAX_POINTS: int = 1_000_000
+    LOCATION_INDEX_TTL_SECONDS: int = 60
+    CLUSTER_MAX_ZOOM: int = 8
+    CLUSTER_BASE_CELLS: int = 8
+    CLUSTER_MAX_PER_RESPONSE: int = 1000
+    IMAGE_PROCESS_WORKERS: int = 2
+    TILE_SIZE: int = 256
+    TILE_RETRY_SECONDS: int = 3600
+    IMAGE_VARIANT_MAX_DIMENSION: int = 2048
+    IMAGE_VARIANT_CACHE_MAX_BYTES: int = 1024 ** 3
+    UPLOAD_MAX_BYTES: int = 64 * 1024 ** 2
+    LOCATION_BATCH_MAX_SIZE: int = 10_000
+    POPULAR_WORLDS_LIMIT: int = 100
+    POPULAR_WORLDS_REFRESH_SECONDS: int = 300
+    POPULAR_WORLDS_HALF_LIFE_HOURS: int = 72
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10_000
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 60
+    BCRYPT_ROUNDS: int = 12
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_PENDING: int = 64
+    PASSWORD_HASH_SLOW_QUEUE_SECONDS: float = 0.5
+    RATE_LIMIT_BACKEND: str | None = None
+    LOGIN_RATE_LIMIT_IP_BURST: int = 20
+    LOGIN_RATE_LIMIT_IP_PER_MINUTE: float = 10
+    LOGIN_RATE_LIMIT_USERNAME_BURST: int = 5
+    LOGIN_RATE_LIMIT_USERNAME_PER_MINUTE: float = 3
+    RESPONSE_CACHE_BACKEND: str | None = None
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_TTL_SECONDS: float = 60
+    HOT_FILE_CACHE_MAX_BYTES: int = 64 * 1024 ** 2
+    HOT_FILE_MAX_BYTES: int = 256 * 1024
+    HOT_FILE_CHECK_SECONDS: int = 60
+    FILE_CLEANUP_GRACE_HOURS: int = 24
+    FILE_CLEANUP_BATCH_SIZE: int = 500
+    FILE_CLEANUP_PAUSE_SECONDS: float = 1.0
 
 
 config = Config(_env_file= '.env', _env_file_encoding = 'utf-8')
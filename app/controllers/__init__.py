@@ -1,3 +1,18 @@
 from .database import *
 from .oauth2 import *
-from .locations import *
\ No newline at end of file
+from .locations import *
+from .pagination import *
+from .search import *
+from .loading import *
+from .spatial import *
+from .images import *
+from .tiles import *
+from .variants import *
+from .storage import *
+from .uploads import *
+from .static_files import *
+from .cleanup import *
+from .popularity import *
+from .ratelimit import *
+from .response_cache import *
+from .versions import *
\ No newline at end of file
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+import aiofiles.os
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from .static_files import hot_file_cache
+from .storage import get_file_path, get_legacy_file_path
+from .tiles import get_legacy_tiles_dir, get_tiles_dir
+from .variants import remove_image_variants
+
+
+logger = logging.getLogger(__name__)
+
+
+class CleanupReport(NamedTuple):
+    files: int
+    bytes: int
+
+
+def get_unreferenced_filter():
+    """Matches files no world, location image or avatar points to.
+
+    Every NOT EXISTS is an anti-join served by an index on the referencing
+    column (the primary key of locations_images leads with the image).
+    """
+
+    filename = models.File.filename
+
+    return sa.and_(
+        ~sa.exists().where(models.World.map_image == filename),
+        ~sa.exists().where(models.World.cover_image == filename),
+        ~sa.exists().where(models.LocationImage.image == filename),
+        ~sa.exists().where(models.User.avatar_image == filename),
+    )
+
+
+async def _get_file_size(filename: str) -> int:
+    for path in (get_file_path(filename), get_legacy_file_path(filename)):
+        try:
+            return (await aiofiles.os.stat(path)).st_size
+        except FileNotFoundError:
+            pass
+
+    return 0
+
+
+async def _remove_stored_file(filename: str) -> int:
+    """Removes a file with its tiles from either layout, returns the bytes freed"""
+
+    size = 0
+
+    for path in (get_file_path(filename), get_legacy_file_path(filename)):
+        hot_file_cache.discard(path)
+
+        try:
+            size += (await aiofiles.os.stat(path)).st_size
+            await aiofiles.os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    for tiles_dir in (get_tiles_dir(filename), get_legacy_tiles_dir(filename)):
+        await asyncio.to_thread(shutil.rmtree, tiles_dir, ignore_errors=True)
+
+    return size
+
+
+async def _remove_variants(filenames: list[str]) -> int:
+    size = 0
+
+    for path, variant_size in await asyncio.to_thread(remove_image_variants, filenames):
+        hot_file_cache.discard(path)
+        size += variant_size
+
+    return size
+
+
+async def collect_orphan_files(
+    db: AsyncSession,
+    grace_period: timedelta,
+    batch_size: int,
+    pause: float,
+    dry_run: bool = False
+) -> CleanupReport:
+    """Deletes uploaded files that nothing references, in batches.
+
+    Only files last uploaded more than `grace_period` ago are considered,
+    so an upload, including a duplicate of an existing file, has time to be
+    attached to a world, location or profile. Batches walk the files by
+    primary key and are separated by `pause` seconds. References are
+    checked again by the DELETE itself, and the files are removed from disk,
+    with their tiles and resized variants, only after the rows are
+    committed. App workers stop serving a deleted file from memory within
+    HOT_FILE_CHECK_SECONDS.
+    """
+
+    cutoff = datetime.now(timezone.utc) - grace_period
+    files = 0
+    reclaimed = 0
+    last_filename = None
+
+    while True:
+        query = (
+            sa.select(models.File.filename)
+            .where(models.File.last_uploaded_at < cutoff, get_unreferenced_filter())
+            .order_by(models.File.filename)
+            .limit(batch_size)
+        )
+        if last_filename is not None:
+            query = query.where(models.File.filename > last_filename)
+
+        data = await db.execute(query)
+        filenames = data.scalars().all()
+        await db.rollback()
+
+        if not filenames:
+            break
+
+        last_filename = filenames[-1]
+
+        if dry_run:
+            for filename in filenames:
+                reclaimed += await _get_file_size(filename)
+            files += len(filenames)
+        else:
+            data = await db.execute(
+                sa.delete(models.File)
+                .where(models.File.filename.in_(filenames), get_unreferenced_filter())
+                .returning(models.File.filename)
+                .execution_options(synchronize_session=False)
+            )
+            deleted = data.scalars().all()
+            await db.commit()
+
+            for filename in deleted:
+                reclaimed += await _remove_stored_file(filename)
+            if deleted:
+                reclaimed += await _remove_variants(deleted)
+            files += len(deleted)
+
+        logger.info('%d files, %d bytes so far', files, reclaimed)
+
+        if len(filenames) < batch_size:
+            break
+
+        await asyncio.sleep(pause)
+
+    return CleanupReport(files, reclaimed)
@@ -1,18 +1,208 @@
+import bisect
+import itertools
+import logging
+import random
+import re
+import time
+
+import sqlalchemy as sa
+from fastapi import Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from ..config import config
 
 DB_URL = f'postgresql+asyncpg://{config.DB_USER}:{config.DB_PASSWORD}@{config.DB_HOST}:{config.DB_PORT}/{config.DB_NAME}'
+DB_REPLICA_URLS = [
+    f'postgresql+asyncpg://{config.DB_USER}:{config.DB_PASSWORD}@{host.strip()}/{config.DB_NAME}'
+    for host in (config.DB_REPLICA_HOSTS or '').split(',')
+    if host.strip()
+]
+
+# Upper bounds in seconds of the checkout wait histogram buckets
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, float('inf'))
+
+# Cookie with the WAL position of the client's last commit on the primary
+READ_AFTER_LSN_COOKIE = 'darts_read_after_lsn'
+LSN_PATTERN = re.compile(r'^[0-9A-F]{1,8}/[0-9A-F]{1,8}$')
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
-engine = create_async_engine(DB_URL, echo=True)
+
+class PoolStats:
+    """Checkout metrics of a connection pool of this worker"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.timeouts = 0
+        self.wait_buckets = [0] * len(POOL_WAIT_BUCKETS)
+        self.max_wait_seconds = 0.0
+
+    def record_checkout(self, wait_seconds: float, overflow: bool):
+        self.checkouts += 1
+        self.overflow_checkouts += overflow
+        self.wait_buckets[bisect.bisect_left(POOL_WAIT_BUCKETS, wait_seconds)] += 1
+        self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that times how long a checkout waits for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        # Keeps the metrics when the engine is disposed
+        pool = super().recreate()
+        pool.stats = self.stats
+
+        return pool
+
+    def _do_get(self):
+        started_at = time.perf_counter()
+
+        try:
+            connection = super()._do_get()
+        except sa.exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+
+        self.stats.record_checkout(time.perf_counter() - started_at, self.overflow() > 0)
+
+        return connection
+
+
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        echo=config.DB_ECHO,
+        poolclass=InstrumentedQueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=config.DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+    )
+
+
+engine = _create_engine(DB_URL)
+replica_engines = [_create_engine(url) for url in DB_REPLICA_URLS]
 
 async_session = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False, autoflush=True
 )
+replica_sessions = [
+    sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False, autoflush=True)
+    for replica_engine in replica_engines
+]
+_next_replica_session = itertools.cycle(replica_sessions)
+
+
+# The start time is kept on the execution context, which is dropped with the
+# statement, so a failed statement leaves nothing behind on the connection
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started_at = time.perf_counter()
+
+
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, 'query_started_at', None)
+
+    if started_at is None:
+        return
+
+    elapsed = time.perf_counter() - started_at
+
+    if elapsed >= config.DB_SLOW_QUERY_SECONDS and random.random() < config.DB_SLOW_QUERY_SAMPLE_RATE:
+        logger.warning('slow query (%.3fs): %s', elapsed, ' '.join(statement.split())[:1000])
+
+
+for _engine in (engine, *replica_engines):
+    sa.event.listen(_engine.sync_engine, 'before_cursor_execute', _start_query_timer)
+    sa.event.listen(_engine.sync_engine, 'after_cursor_execute', _log_slow_query)
+
+
+@sa.event.listens_for(Session, 'after_commit')
+def _mark_committed(session):
+    """Flags the request of a primary session, see `read_your_writes_middleware`"""
+
+    request_state = session.info.get('request_state')
+
+    if request_state is not None:
+        request_state.db_committed = True
+
+
+async def read_your_writes_middleware(request: Request, call_next) -> Response:
+    """Hands a client that committed a write the primary's WAL position.
+
+    The position travels in a short-lived cookie, so the guarantee holds
+    whichever worker serves the client's next read.
+    """
+
+    response = await call_next(request)
+
+    if replica_sessions and getattr(request.state, 'db_committed', False):
+        async with engine.connect() as conn:
+            lsn = await conn.scalar(sa.text('SELECT pg_current_wal_lsn()::text'))
+
+        response.set_cookie(
+            READ_AFTER_LSN_COOKIE,
+            lsn,
+            max_age=int(config.DB_READ_YOUR_WRITES_SECONDS),
+            httponly=True,
+            samesite='lax'
+        )
+
+    return response
+
+
+async def _has_replayed(session_factory, lsn: str) -> bool:
+    """Whether the replica has replayed the WAL up to `lsn`"""
+
+    async with session_factory() as session:
+        replayed = await session.scalar(
+            sa.text('SELECT pg_last_wal_replay_lsn() >= CAST(CAST(:lsn AS text) AS pg_lsn)'),
+            {'lsn': lsn}
+        )
+
+    # NULL when the server is not a standby
+    return bool(replayed)
+
+
+def _get_pool_status(name: str, pool: InstrumentedQueuePool) -> dict:
+    return {
+        'name': name,
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'idle': pool.checkedin(),
+        'overflow': max(pool.overflow(), 0),
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'checkouts': pool.stats.checkouts,
+        'overflow_checkouts': pool.stats.overflow_checkouts,
+        'timeouts': pool.stats.timeouts,
+        'max_wait_seconds': pool.stats.max_wait_seconds,
+        'wait_seconds_histogram': {
+            str(bound): count for bound, count in zip(POOL_WAIT_BUCKETS, pool.stats.wait_buckets)
+        },
+    }
+
+
+def get_pool_status() -> list[dict]:
+    """Live state and checkout metrics of the primary and replica pools of this worker"""
+
+    return [
+        _get_pool_status('primary', engine.sync_engine.pool),
+        *(
+            _get_pool_status(f'replica:{replica_engine.url.host}:{replica_engine.url.port}', replica_engine.sync_engine.pool)
+            for replica_engine in replica_engines
+        ),
+    ]
 
 
 # We don't need this if alembic is configured
@@ -23,6 +213,30 @@ async def init_models():
 
 
 # Dependency
-async def get_session() -> AsyncSession:
+async def get_session(request: Request) -> AsyncSession:
+    """Session on the primary, for handlers that write"""
+
     async with async_session() as session:
+        session.info['request_state'] = request.state
+        yield session
+
+
+async def get_read_session(request: Request) -> AsyncSession:
+    """Session on a read replica, for read-only handlers.
+
+    Falls back to the primary when no replica is configured, and when the
+    client committed a write within DB_READ_YOUR_WRITES_SECONDS that the
+    replica has not replayed yet, so it does not miss its own write.
+    """
+
+    session_factory = async_session
+
+    if replica_sessions:
+        session_factory = next(_next_replica_session)
+        lsn = request.cookies.get(READ_AFTER_LSN_COOKIE)
+
+        if lsn is not None and (not LSN_PATTERN.match(lsn) or not await _has_replayed(session_factory, lsn)):
+            session_factory = async_session
+
+    async with session_factory() as session:
         yield session
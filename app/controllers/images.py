@@ -0,0 +1,33 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable
+
+from app.config import config
+
+
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Returns the worker-wide pool used for CPU-heavy image processing"""
+
+    global _process_pool
+
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=config.IMAGE_PROCESS_WORKERS)
+
+    return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+def run_in_process_pool(func: Callable, *args: Any) -> asyncio.Future:
+    """Runs `func(*args)` in the image process pool without blocking the event loop"""
+
+    return asyncio.get_running_loop().run_in_executor(get_process_pool(), func, *args)
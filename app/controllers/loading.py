@@ -0,0 +1,94 @@
+from sqlalchemy.orm import joinedload, load_only, selectinload
+
+from app import models
+
+
+# Relationships are declared with lazy='raise_on_sql', so every endpoint
+# has to state what it renders. Many-to-one links are joined (one row per
+# parent), collections are loaded with a separate SELECT ... IN so the row
+# count never multiplies across the World -> Location -> images graph.
+
+WORLD_FIELDS = ('name', 'description', 'map_image', 'cover_image', 'id', 'created_at', 'favourite_count')
+WORLD_EXPANSIONS = ('creator', 'locations', 'images')
+
+LOCATION_FIELDS = ('name', 'description', 'world_id', 'coord_x', 'coord_y', 'id', 'created_at')
+LOCATION_EXPANSIONS = ('creator', 'images')
+
+
+def parse_list_param(value: str | None, allowed: tuple[str, ...]) -> set[str] | None:
+    """Parses a comma-separated query parameter such as `fields` or `expand`.
+
+    Returns None when the parameter was not passed. Raises ValueError on
+    values that are not in `allowed`.
+    """
+
+    if value is None:
+        return None
+
+    items = {item.strip() for item in value.split(',') if item.strip()}
+    unknown = items.difference(allowed)
+
+    if unknown:
+        raise ValueError(f'unknown value(s): {", ".join(sorted(unknown))}')
+
+    return items
+
+
+def get_location_out_options(
+    fields: set[str] | None = None,
+    expand: set[str] | None = None
+) -> list:
+    """Loader options for rendering `schemas.LocationOut` or `schemas.LocationSparse`.
+
+    `fields=None` loads every column, `expand=None` loads every relationship.
+    """
+
+    expand = set(LOCATION_EXPANSIONS) if expand is None else expand
+    options = []
+
+    if fields is not None:
+        # The version is always loaded, it makes the ETag
+        options.append(load_only(models.Location.version, *[getattr(models.Location, field) for field in fields]))
+    if 'creator' in expand:
+        options.append(joinedload(models.Location.creator))
+    if 'images' in expand:
+        options.append(selectinload(models.Location.images))
+
+    return options
+
+
+def get_world_out_options(
+    fields: set[str] | None = None,
+    expand: set[str] | None = None
+) -> list:
+    """Loader options for rendering `schemas.WorldOut` or `schemas.WorldSparse`.
+
+    `creator` and `images` expand both the world and its locations, so they
+    only reach the locations table when `locations` is expanded as well.
+    """
+
+    expand = set(WORLD_EXPANSIONS) if expand is None else expand
+    options = []
+
+    if fields is not None:
+        options.append(load_only(models.World.version, *[getattr(models.World, field) for field in fields]))
+    if 'creator' in expand:
+        options.append(joinedload(models.World.creator))
+    if 'locations' in expand:
+        options.append(selectinload(models.World.locations))
+
+        if 'creator' in expand:
+            options.append(selectinload(models.World.locations).joinedload(models.Location.creator))
+        if 'images' in expand:
+            options.append(selectinload(models.World.locations).selectinload(models.Location.images))
+
+    return options
+
+
+def get_user_profile_options() -> list:
+    """Loader options for rendering `schemas.UserProfile`"""
+
+    return [
+        selectinload(models.User.worlds),
+        selectinload(models.User.locations),
+    ]
@@ -1,3 +1,4 @@
+from typing import Iterator
 from uuid import UUID
 
 import sqlalchemy as sa
@@ -8,31 +9,68 @@ from sqlalchemy.dialects.postgresql import insert as psql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import models, schemas
+from .response_cache import location_tag, response_cache
+from .versions import bump_location_version
 
 
-async def add_location_image_to_db(
+# asyncpg binds at most 32767 parameters per statement
+MAX_QUERY_PARAMETERS = 32767
+
+
+def _chunk_rows(rows: list[dict]) -> Iterator[list[dict]]:
+    size = max(1, MAX_QUERY_PARAMETERS // len(rows[0]))
+
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+async def insert_locations(db: AsyncSession, rows: list[dict]):
+    """Inserts locations with multi-row INSERTs, without committing.
+
+    Rows must have the same keys; ids are expected to be set by the caller.
+    """
+
+    for chunk in _chunk_rows(rows):
+        await db.execute(sa.insert(models.Location).values(chunk))
+
+
+async def insert_location_images(db: AsyncSession, rows: list[dict]):
+    """Attaches images to locations in bulk, without committing.
+
+    Images that are already attached are skipped. Raises IntegrityError if an
+    image or a location does not exist.
+    """
+
+    for chunk in _chunk_rows(rows):
+        await db.execute(
+            psql_insert(models.LocationImage)
+            .values(chunk)
+            .on_conflict_do_nothing(index_elements=['image', 'location_id'])
+        )
+
+
+async def add_location_images_to_db(
     db: AsyncSession,
     location_id: UUID,
-    image: schemas.LocationImageIn | dict
+    images: list[schemas.LocationImageIn | dict]
 ) -> Response | JSONResponse:
-    """Adds an image to a specific location"""
-
-    if type(image) is not dict:
-        data = image.dict()
-    else:
-        data = image
+    """Adds images to a specific location with one statement and one commit"""
 
-    data.update({'location_id': location_id})
-
-    insert_stmt = psql_insert(models.LocationImage).values(**data)
-    query = insert_stmt.on_conflict_do_nothing(index_elements=['image', 'location_id'])
+    rows = [
+        {**(image if isinstance(image, dict) else image.dict()), 'location_id': location_id}
+        for image in images
+    ]
 
     try:
-        await db.execute(query)
+        if rows:
+            await insert_location_images(db, rows)
+            await bump_location_version(db, location_id)
         await db.commit()
+        await response_cache.invalidate(location_tag(location_id))
 
         return Response(status_code=status.HTTP_201_CREATED)
     except sa.exc.IntegrityError:
+        await db.rollback()
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
             content={
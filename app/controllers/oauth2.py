@@ -1,4 +1,7 @@
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from typing import NamedTuple
 from uuid import UUID
 
 from fastapi import Depends, HTTPException, status
@@ -17,6 +20,55 @@ ALGORITHM = config.JWT_ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = config.JWT_ACCESS_TOKEN_EXPIRE_MINUTES
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='api/auth/login')
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl='api/auth/login', auto_error=False)
+
+
+class Principal(NamedTuple):
+    """The authorized user, without the rest of the account"""
+
+    id: UUID
+    username: str
+
+
+class PrincipalCache:
+    """Per-worker TTL LRU of the principals behind valid tokens.
+
+    Saves the user lookup on every authenticated request. Entries are
+    dropped by `discard` when the account changes in this worker; other
+    workers notice after at most `ttl` seconds.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[UUID, tuple[float, Principal]] = OrderedDict()
+
+    def get(self, user_id: UUID) -> Principal | None:
+        entry = self._entries.get(user_id)
+
+        if entry is None:
+            return None
+
+        expires_at, principal = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return None
+
+        self._entries.move_to_end(user_id)
+        return principal
+
+    def put(self, principal: Principal):
+        self._entries[principal.id] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(principal.id)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, user_id: UUID):
+        self._entries.pop(user_id, None)
+
+
+principal_cache = PrincipalCache(config.PRINCIPAL_CACHE_MAX_SIZE, config.PRINCIPAL_CACHE_TTL_SECONDS)
 
 
 def create_access_token(data: dict) -> str:
@@ -63,4 +115,61 @@ async def get_current_user(
     query = await db.execute(select(models.User).where(models.User.id == token.id))
     user = query.scalars().first()
 
+    if user is not None:
+        principal_cache.put(Principal(user.id, user.username))
+
     return user
+
+
+async def get_current_principal(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(database.get_session)
+) -> Principal:
+    """Like `get_current_user`, but served from `principal_cache` when possible.
+
+    For endpoints that only need to know who the user is.
+    """
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='invalid credentials',
+        headers={'WWW-Authenticate': 'Bearer'}
+    )
+
+    token = verify_access_token(token, credentials_exception)
+    principal = principal_cache.get(token.id)
+
+    if principal is None:
+        query = await db.execute(select(models.User.id, models.User.username).where(models.User.id == token.id))
+        row = query.first()
+
+        # The account was deleted after the token was issued
+        if row is None:
+            raise credentials_exception
+
+        principal = Principal(row.id, row.username)
+        principal_cache.put(principal)
+
+    return principal
+
+
+async def get_optional_user_id(token: str | None = Depends(oauth2_scheme_optional)) -> UUID | None:
+    """Id of the authorized user from the token alone, or None for anonymous requests.
+
+    An expired or invalid token is treated as no token, so public endpoints
+    keep working for clients holding a stale one.
+    """
+
+    if token is None:
+        return None
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='invalid credentials',
+        headers={'WWW-Authenticate': 'Bearer'}
+    )
+
+    try:
+        return verify_access_token(token, credentials_exception).id
+    except (HTTPException, ValueError):
+        return None
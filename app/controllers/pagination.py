@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Sequence
+from uuid import UUID
+
+import sqlalchemy as sa
+from sqlalchemy.sql import Select
+
+from app.config import config
+
+
+def get_page_limit(limit: int | None) -> int:
+    """Clamps the requested page size to the server-side bounds"""
+
+    if limit is None or limit < 1:
+        return config.PAGINATION_DEFAULT_LIMIT
+
+    return min(limit, config.PAGINATION_MAX_LIMIT)
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Packs the sort key of the last row into an opaque string"""
+
+    data = [str(value) if isinstance(value, UUID) else value for value in values]
+    data = [value.isoformat() if isinstance(value, datetime) else value for value in data]
+    payload = json.dumps(data, separators=(',', ':')).encode()
+
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, keys: Sequence[sa.Column]) -> list[Any]:
+    """Unpacks a cursor made by `encode_cursor`.
+
+    Raises ValueError if the cursor is malformed or does not match the keys.
+    """
+
+    payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    values = json.loads(payload)
+
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError('invalid cursor')
+
+    decoded = []
+    for key, value in zip(keys, values):
+        python_type = key.type.python_type
+
+        try:
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is UUID:
+                value = UUID(value)
+            elif not isinstance(value, python_type):
+                raise ValueError('invalid cursor')
+        except (TypeError, AttributeError):
+            raise ValueError('invalid cursor')
+
+        decoded.append(value)
+
+    return decoded
+
+
+def paginate(
+    statement: Select,
+    keys: Sequence[sa.Column],
+    limit: int,
+    offset: int | None = None,
+    cursor: str | None = None
+) -> Select:
+    """Orders the statement by `keys` and applies keyset or offset pagination.
+
+    The cursor takes precedence over the offset, which is kept for compatibility.
+    """
+
+    statement = statement.order_by(*keys).limit(limit)
+
+    if cursor is None:
+        return statement.offset(offset)
+
+    values = decode_cursor(cursor, keys)
+    bound = sa.tuple_(*[sa.literal(value, key.type) for key, value in zip(keys, values)])
+
+    return statement.where(sa.tuple_(*keys) > bound)
+
+
+def _get_key_value(item: Any, key: sa.Column) -> Any:
+    if isinstance(item, sa.engine.Row):
+        if key.key in item._mapping:
+            return item._mapping[key.key]
+        item = item[0]
+
+    return getattr(item, key.key)
+
+
+def get_next_cursor(items: Sequence[Any], keys: Sequence[sa.Column], limit: int) -> str | None:
+    """Returns a cursor pointing after the last item, or None on the last page.
+
+    Items may be ORM objects or rows whose first element is the ORM object,
+    with computed keys (e.g. search relevance) selected as labeled columns.
+    """
+
+    if len(items) < limit:
+        return None
+
+    return encode_cursor([_get_key_value(items[-1], key) for key in keys])
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import math
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+import sqlalchemy as sa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.config import config
+from .database import async_session
+
+
+logger = logging.getLogger(__name__)
+
+# Favourites older than this many half-lives add less than 0.4% of a fresh one
+POPULARITY_WINDOW_HALF_LIVES = 8
+
+_popular_worlds_task: asyncio.Task | None = None
+_popular_worlds_lock = asyncio.Lock()
+
+
+class PopularWorlds:
+    """Ranking of the most popular worlds, recomputed in the background"""
+
+    def __init__(self):
+        self.world_ids: list[UUID] = []
+        self.updated_at: datetime | None = None
+
+    def set(self, world_ids: list[UUID]):
+        self.world_ids = world_ids
+        self.updated_at = datetime.now(timezone.utc)
+
+
+popular_worlds = PopularWorlds()
+
+
+async def increment_favourite_count(db: AsyncSession, world_id: UUID, delta: int):
+    """Adjusts the denormalized counter in the caller's transaction"""
+
+    await db.execute(
+        sa.update(models.World)
+        .where(models.World.id == world_id)
+        .values(favourite_count=models.World.favourite_count + delta, version=models.World.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def get_favourite_world_ids(db: AsyncSession, user_id: UUID, world_ids: list[UUID]) -> set[UUID]:
+    """Which of the worlds the user has favourited, in one primary key lookup"""
+
+    if not world_ids:
+        return set()
+
+    data = await db.execute(
+        sa.select(models.FavouriteWorld.world_id)
+        .where(
+            models.FavouriteWorld.world_id.in_(world_ids),
+            models.FavouriteWorld.user_id == user_id
+        )
+    )
+
+    return set(data.scalars())
+
+
+async def reconcile_favourite_counts(db: AsyncSession, batch_size: int) -> int:
+    """Recounts the favourites of every world in batches, returns the worlds fixed.
+
+    Repairs drift of `World.favourite_count`, e.g. from favourites removed by
+    a cascading user delete.
+    """
+
+    count = (
+        sa.select(sa.func.count())
+        .where(models.FavouriteWorld.world_id == models.World.id)
+        .scalar_subquery()
+    )
+    fixed = 0
+    last_id = None
+
+    while True:
+        query = sa.select(models.World.id).order_by(models.World.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(models.World.id > last_id)
+
+        data = await db.execute(query)
+        world_ids = data.scalars().all()
+
+        if not world_ids:
+            await db.rollback()
+            break
+
+        result = await db.execute(
+            sa.update(models.World)
+            .where(models.World.id.in_(world_ids), models.World.favourite_count != count)
+            .values(favourite_count=count, version=models.World.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+        fixed += result.rowcount
+        last_id = world_ids[-1]
+
+        if len(world_ids) < batch_size:
+            break
+
+    return fixed
+
+
+async def compute_popular_world_ids(db: AsyncSession, limit: int, half_life: timedelta) -> list[UUID]:
+    """Ranks worlds by their favourites, each decaying exponentially with age.
+
+    Only favourites within the decay window are aggregated (served by the
+    index on `favourite_worlds.created_at`); the ranking is padded with the
+    all-time favourite counts when too few worlds were favourited recently.
+    """
+
+    half_life_seconds = half_life.total_seconds()
+    age = sa.func.extract('epoch', sa.func.now() - models.FavouriteWorld.created_at)
+    score = sa.func.sum(sa.func.exp(-math.log(2) * age / half_life_seconds))
+    window = timedelta(seconds=half_life_seconds * POPULARITY_WINDOW_HALF_LIVES)
+
+    data = await db.execute(
+        sa.select(models.FavouriteWorld.world_id)
+        .where(models.FavouriteWorld.created_at > sa.func.now() - window)
+        .group_by(models.FavouriteWorld.world_id)
+        .order_by(score.desc(), models.FavouriteWorld.world_id)
+        .limit(limit)
+    )
+    world_ids = data.scalars().all()
+
+    if len(world_ids) < limit:
+        query = (
+            sa.select(models.World.id)
+            .where(models.World.favourite_count > 0)
+            .order_by(models.World.favourite_count.desc(), models.World.id)
+            .limit(limit)
+        )
+        data = await db.execute(query)
+        ranked = set(world_ids)
+        world_ids.extend(world_id for world_id in data.scalars() if world_id not in ranked)
+
+    return world_ids[:limit]
+
+
+async def refresh_popular_worlds():
+    async with _popular_worlds_lock:
+        async with async_session() as db:
+            world_ids = await compute_popular_world_ids(
+                db,
+                config.POPULAR_WORLDS_LIMIT,
+                timedelta(hours=config.POPULAR_WORLDS_HALF_LIFE_HOURS)
+            )
+
+    popular_worlds.set(world_ids)
+
+
+async def get_popular_world_ids() -> list[UUID]:
+    """Returns the cached ranking, computing it if the refresher has not run yet"""
+
+    if popular_worlds.updated_at is None:
+        await refresh_popular_worlds()
+
+    return popular_worlds.world_ids
+
+
+async def _refresh_popular_worlds_forever(interval: float):
+    while True:
+        try:
+            await refresh_popular_worlds()
+        except Exception:
+            logger.exception('refreshing popular worlds failed')
+
+        await asyncio.sleep(interval)
+
+
+def start_popular_worlds_refresher():
+    global _popular_worlds_task
+
+    if _popular_worlds_task is None:
+        _popular_worlds_task = asyncio.create_task(
+            _refresh_popular_worlds_forever(config.POPULAR_WORLDS_REFRESH_SECONDS)
+        )
+
+
+def stop_popular_worlds_refresher():
+    global _popular_worlds_task
+
+    if _popular_worlds_task is not None:
+        _popular_worlds_task.cancel()
+        _popular_worlds_task = None
@@ -0,0 +1,90 @@
+import importlib
+import math
+import time
+from collections import OrderedDict
+from typing import Protocol
+
+from app.config import config
+
+
+class RateLimitBackend(Protocol):
+    """Storage of token buckets.
+
+    `take` removes one token from the bucket under `key`, which holds at most
+    `capacity` tokens and regains `rate` tokens per second. It returns 0 if a
+    token was taken, otherwise the seconds until one is available. A backend
+    shared by all workers (e.g. on Redis) can be plugged in with
+    RATE_LIMIT_BACKEND.
+    """
+
+    async def take(self, key: str, capacity: float, rate: float) -> float:
+        ...
+
+
+class MemoryRateLimitBackend:
+    """Per-worker token buckets, the least recently used dropped past `max_keys`"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, capacity: float, rate: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+
+        self._buckets[key] = (tokens, now)
+
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+        return wait
+
+
+_rate_limit_backend: RateLimitBackend | None = None
+
+
+def get_rate_limit_backend() -> RateLimitBackend:
+    """The backend named by RATE_LIMIT_BACKEND (`module:Class`), in memory by default"""
+
+    global _rate_limit_backend
+
+    if _rate_limit_backend is None:
+        if config.RATE_LIMIT_BACKEND:
+            module_name, _, class_name = config.RATE_LIMIT_BACKEND.partition(':')
+            _rate_limit_backend = getattr(importlib.import_module(module_name), class_name)()
+        else:
+            _rate_limit_backend = MemoryRateLimitBackend()
+
+    return _rate_limit_backend
+
+
+async def check_login_rate_limit(client_ip: str, username: str) -> int | None:
+    """Takes a login attempt from the client's and the username's buckets.
+
+    Returns None if the attempt is allowed, otherwise the seconds to put in
+    Retry-After. The username bucket is only charged when the IP is allowed.
+    """
+
+    backend = get_rate_limit_backend()
+
+    wait = await backend.take(
+        f'login:ip:{client_ip}',
+        config.LOGIN_RATE_LIMIT_IP_BURST,
+        config.LOGIN_RATE_LIMIT_IP_PER_MINUTE / 60
+    )
+
+    if not wait:
+        wait = await backend.take(
+            f'login:user:{username.strip().lower()}',
+            config.LOGIN_RATE_LIMIT_USERNAME_BURST,
+            config.LOGIN_RATE_LIMIT_USERNAME_PER_MINUTE / 60
+        )
+
+    return math.ceil(wait) if wait else None
@@ -0,0 +1,267 @@
+import importlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Protocol
+from uuid import UUID
+
+import sqlalchemy as sa
+
+from app.config import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str | None
+    tags: list[str]
+    # Wall clock time the read behind the body started, comparable across workers
+    read_at: float
+
+
+class ResponseCacheBackend(Protocol):
+    """Shared tier of the response cache, e.g. on Redis.
+
+    Entries are rendered response bodies with the tags they depend on;
+    `invalidate` drops every entry carrying one of the tags.
+    """
+
+    async def get(self, key: str) -> CachedResponse | None:
+        ...
+
+    async def set(self, key: str, response: CachedResponse, ttl: float):
+        ...
+
+    async def invalidate(self, tags: list[str]):
+        ...
+
+
+class MemoryResponseCacheBackend:
+    """In-process stand-in for a shared backend, e.g. for development and tests.
+
+    It is not shared between workers; a backend on Redis or memcached
+    implements the same three methods.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, CachedResponse]] = OrderedDict()
+
+    async def get(self, key: str) -> CachedResponse | None:
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] < time.monotonic():
+            return None
+
+        return entry[1]
+
+    async def set(self, key: str, response: CachedResponse, ttl: float):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + ttl, response)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self, tags: list[str]):
+        tags = set(tags)
+
+        for key in [key for key, (_, response) in self._entries.items() if tags.intersection(response.tags)]:
+            del self._entries[key]
+
+
+class ResponseCache:
+    """Rendered responses in a per-worker LRU, backed by an optional shared tier.
+
+    Invalidation is by tag, e.g. `world:<id>`, and takes effect in this
+    worker immediately; other workers keep their local copies for at most
+    `ttl` seconds. A response whose read started before one of its tags was
+    invalidated here (or within the replica lag window after it) is neither
+    stored nor taken from the shared tier, so a write is never undone by a
+    slower concurrent read, in this worker or another one, nor by a failed
+    shared invalidation.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, lag_window: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lag_window = lag_window
+        self._entries: OrderedDict[str, tuple[float, CachedResponse]] = OrderedDict()
+        self._keys_by_tag: dict[str, set[str]] = {}
+        self._invalidated_at: dict[str, float] = {}
+        self._backend: ResponseCacheBackend | None = None
+        self._backend_loaded = False
+
+    @property
+    def backend(self) -> ResponseCacheBackend | None:
+        """The backend named by RESPONSE_CACHE_BACKEND (`module:Class`), if any"""
+
+        if not self._backend_loaded:
+            self._backend_loaded = True
+
+            if config.RESPONSE_CACHE_BACKEND:
+                module_name, _, class_name = config.RESPONSE_CACHE_BACKEND.partition(':')
+                self._backend = getattr(importlib.import_module(module_name), class_name)()
+
+        return self._backend
+
+    def _store_local(self, key: str, response: CachedResponse):
+        self._drop_local(key)
+        self._entries[key] = (time.monotonic() + self.ttl, response)
+
+        for tag in response.tags:
+            self._keys_by_tag.setdefault(tag, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._drop_local(next(iter(self._entries)))
+
+    def _drop_local(self, key: str):
+        entry = self._entries.pop(key, None)
+
+        if entry is None:
+            return
+
+        for tag in entry[1].tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    async def get(self, key: str) -> CachedResponse | None:
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            if entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._drop_local(key)
+
+        if self.backend is None:
+            return None
+
+        try:
+            shared = await self.backend.get(key)
+        except Exception:
+            logger.exception('shared response cache get failed')
+            return None
+
+        if shared is None or self._is_outdated(shared.tags, shared.read_at):
+            return None
+
+        self._store_local(key, shared)
+
+        return shared
+
+    async def put(
+        self,
+        key: str,
+        body: bytes,
+        etag: str | None,
+        tags: Iterable[str],
+        read_started_at: float
+    ):
+        """Stores a response rendered from a read that started at `read_started_at`.
+
+        `read_started_at` is wall clock time (`time.time()`); a read older than
+        the ttl is not stored, which bounds how long invalidations are kept.
+        """
+
+        response = CachedResponse(body, etag, list(tags), read_started_at)
+
+        if time.time() - read_started_at > self.ttl or self._is_outdated(response.tags, read_started_at):
+            return
+
+        self._store_local(key, response)
+
+        if self.backend is not None:
+            try:
+                await self.backend.set(key, response, self.ttl)
+            except Exception:
+                logger.exception('shared response cache set failed')
+
+    def _is_outdated(self, tags: list[str], read_at: float) -> bool:
+        for tag in tags:
+            invalidated_at = self._invalidated_at.get(tag)
+            if invalidated_at is not None and read_at <= invalidated_at + self.lag_window:
+                return True
+
+        return False
+
+    async def invalidate(self, *tags: str):
+        now = time.time()
+
+        for tag in tags:
+            self._invalidated_at[tag] = now
+
+            for key in list(self._keys_by_tag.get(tag, ())):
+                self._drop_local(key)
+
+        # A shared entry read before a mark is stored at most `ttl` later and
+        # lives `ttl` more, so older marks are no longer needed
+        if len(self._invalidated_at) > 10 * self.max_entries:
+            cutoff = now - 2 * self.ttl - self.lag_window
+            self._invalidated_at = {
+                tag: invalidated_at
+                for tag, invalidated_at in self._invalidated_at.items()
+                if invalidated_at >= cutoff
+            }
+
+        if self.backend is not None:
+            try:
+                await self.backend.invalidate(list(tags))
+            except Exception:
+                logger.exception('shared response cache invalidation failed')
+
+
+response_cache = ResponseCache(
+    config.RESPONSE_CACHE_MAX_ENTRIES,
+    config.RESPONSE_CACHE_TTL_SECONDS,
+    config.DB_READ_YOUR_WRITES_SECONDS if config.DB_REPLICA_HOSTS else 0
+)
+
+
+def get_response_cache_key(resource: str, id: UUID, fields: set[str] | None, expand: set[str] | None) -> str:
+    fields = '*' if fields is None else ','.join(sorted(fields))
+    expand = '*' if expand is None else ','.join(sorted(expand))
+
+    return f'{resource}:{id!s}:fields={fields}:expand={expand}'
+
+
+def world_tag(world_id: UUID) -> str:
+    return f'world:{world_id!s}'
+
+
+def location_tag(location_id: UUID) -> str:
+    return f'location:{location_id!s}'
+
+
+def user_tag(user_id: UUID) -> str:
+    return f'user:{user_id!s}'
+
+
+def _get_creator_tags(row) -> list[str]:
+    if 'creator' in sa.inspect(row).unloaded or row.creator is None:
+        return []
+
+    return [user_tag(row.creator.id)]
+
+
+def get_world_cache_tags(world) -> list[str]:
+    """Tags of a rendered world, including those of the locations and users it embeds"""
+
+    tags = [world_tag(world.id), *_get_creator_tags(world)]
+
+    if 'locations' not in sa.inspect(world).unloaded:
+        for location in world.locations:
+            tags.append(location_tag(location.id))
+            tags.extend(_get_creator_tags(location))
+
+    return list(dict.fromkeys(tags))
+
+
+def get_location_cache_tags(location) -> list[str]:
+    """Tags of a rendered location, including those of the user it embeds"""
+
+    return [location_tag(location.id), *_get_creator_tags(location)]
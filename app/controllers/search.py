@@ -0,0 +1,31 @@
+from typing import Sequence
+
+import sqlalchemy as sa
+
+
+def escape_like(value: str) -> str:
+    """Escapes LIKE wildcards so the search term is matched literally"""
+
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def get_search_filter(columns: Sequence[sa.Column], search: str):
+    """Matches rows containing the term in any of the columns.
+
+    ILIKE '%term%' is served by the pg_trgm GIN indexes on these columns.
+    Terms shorter than 3 characters have no trigram of their own, so the
+    index can not narrow them down and they cost a full scan, but they
+    still match anywhere in the column.
+    """
+
+    pattern = f'%{escape_like(search)}%'
+
+    return sa.or_(*[column.ilike(pattern, escape='\\') for column in columns])
+
+
+def get_search_relevance(columns: Sequence[sa.Column], search: str) -> sa.sql.elements.Label:
+    """Trigram relevance of the best matching column, negated to sort ascending"""
+
+    scores = [sa.func.word_similarity(search, sa.func.coalesce(column, '')) for column in columns]
+
+    return (-sa.func.greatest(*scores, type_=sa.Float)).label('relevance')
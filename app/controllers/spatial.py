@@ -0,0 +1,724 @@
+import asyncio
+import heapq
+import logging
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Coroutine, Iterable, Iterator, NamedTuple
+from uuid import UUID
+
+import sqlalchemy as sa
+from PIL import Image
+from sqlalchemy.dialects.postgresql import array_agg
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.config import config
+from .database import async_session
+from .storage import find_file_path
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_bbox(value: str) -> tuple[float, float, float, float]:
+    """Parses `x1,y1,x2,y2` into (min_x, min_y, max_x, max_y).
+
+    Raises ValueError if the value is not four comma-separated finite numbers.
+    """
+
+    coords = [float(item) for item in value.split(',')]
+
+    if len(coords) != 4:
+        raise ValueError('bbox must be x1,y1,x2,y2')
+
+    if not all(math.isfinite(coord) for coord in coords):
+        raise ValueError('bbox coordinates must be finite')
+
+    x1, y1, x2, y2 = coords
+
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+def get_location_point():
+    """The point expression covered by the GiST index on locations"""
+
+    return sa.func.point(models.Location.coord_x, models.Location.coord_y)
+
+
+def get_bbox_filter(bbox: tuple[float, float, float, float]):
+    """Matches locations inside the box (edges included)"""
+
+    min_x, min_y, max_x, max_y = bbox
+    box = sa.func.box(sa.func.point(min_x, min_y), sa.func.point(max_x, max_y))
+
+    return get_location_point().op('<@')(box)
+
+
+class LocationGrid:
+    """Uniform grid over the locations of one world for k-nearest lookups.
+
+    Points are bucketed by cell, so inserts, moves and removals are O(1) and
+    a query only scans the rings of cells around the requested point.
+    """
+
+    POINTS_PER_CELL = 4
+
+    def __init__(self, points: Iterable[tuple[UUID, float, float]]):
+        points = list(points)
+
+        self.cell_size = self._get_cell_size(points)
+        self.points: dict[UUID, tuple[float, float]] = {}
+        self.cells: dict[tuple[int, int], dict[UUID, tuple[float, float]]] = {}
+
+        for location_id, x, y in points:
+            self.add(location_id, x, y)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @classmethod
+    def _get_cell_size(cls, points: list[tuple[UUID, float, float]]) -> float:
+        if len(points) < 2:
+            return 1.0
+
+        width = max(p[1] for p in points) - min(p[1] for p in points)
+        height = max(p[2] for p in points) - min(p[2] for p in points)
+        per_cell = cls.POINTS_PER_CELL / len(points)
+
+        return math.sqrt(width * height * per_cell) or max(width, height) * per_cell or 1.0
+
+    def _get_cell(self, x: float, y: float) -> tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, location_id: UUID, x: float, y: float):
+        """Inserts the point, moving it if it is already in the grid"""
+
+        self.remove(location_id)
+        self.points[location_id] = (x, y)
+        self.cells.setdefault(self._get_cell(x, y), {})[location_id] = (x, y)
+
+    def remove(self, location_id: UUID):
+        point = self.points.pop(location_id, None)
+
+        if point is None:
+            return
+
+        cell = self._get_cell(*point)
+        del self.cells[cell][location_id]
+
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def _iter_ring(self, cx: int, cy: int, ring: int) -> Iterator[tuple[int, int]]:
+        if ring == 0:
+            yield cx, cy
+            return
+
+        for dx in range(-ring, ring + 1):
+            yield cx + dx, cy - ring
+            yield cx + dx, cy + ring
+        for dy in range(-ring + 1, ring):
+            yield cx - ring, cy + dy
+            yield cx + ring, cy + dy
+
+    def nearest(self, x: float, y: float, k: int) -> list[UUID]:
+        """Returns the ids of the k points closest to (x, y), nearest first"""
+
+        def distance(item):
+            return (item[1][0] - x) ** 2 + (item[1][1] - y) ** 2
+
+        k = min(k, len(self.points))
+        cx, cy = self._get_cell(x, y)
+        heap: list[tuple[float, UUID]] = []
+        seen = 0
+        ring = 0
+
+        while seen < len(self.points):
+            # Far from the occupied area rings are mostly empty, scan directly
+            if (2 * ring + 1) ** 2 > 4 * len(self.cells):
+                best = heapq.nsmallest(k, self.points.items(), key=distance)
+                return [location_id for location_id, _ in best]
+
+            for cell in self._iter_ring(cx, cy, ring):
+                for item in self.cells.get(cell, {}).items():
+                    seen += 1
+                    entry = (-distance(item), item[0])
+
+                    if len(heap) < k:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+
+            # Points outside the scanned square are at least ring * cell_size away
+            if len(heap) == k and (ring * self.cell_size) ** 2 >= -heap[0][0]:
+                break
+
+            ring += 1
+
+        return [location_id for _, location_id in sorted(heap, reverse=True)]
+
+
+class MapExtent(NamedTuple):
+    """Origin of the cluster grid and the cell size at zoom 0"""
+
+    origin_x: float
+    origin_y: float
+    base_size: float
+
+
+class ClusterAccumulator:
+    __slots__ = ('count', 'sum_x', 'sum_y', 'sample_ids', 'stale')
+
+    def __init__(self):
+        self.count = 0
+        self.sum_x = 0.0
+        self.sum_y = 0.0
+        self.sample_ids: list[UUID] = []
+        self.stale = False
+
+
+class LocationClusters:
+    """Grid clusters of one world's locations for every zoom level.
+
+    Zoom 0 splits the map extent into CLUSTER_BASE_CELLS cells per side and
+    each next level halves the cell size. Clusters keep running sums, so
+    adding, moving or removing a location touches one cluster per level.
+    """
+
+    SAMPLE_SIZE = 5
+
+    def __init__(self, points: Iterable[tuple[UUID, float, float]], extent: MapExtent, max_zoom: int):
+        self.origin_x, self.origin_y, self.base_size = extent
+
+        self.points: dict[UUID, tuple[float, float]] = {}
+        self.levels: list[dict[tuple[int, int], ClusterAccumulator]] = [{} for _ in range(max_zoom + 1)]
+
+        for location_id, x, y in points:
+            self.add(location_id, x, y)
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _get_cell(self, zoom: int, x: float, y: float) -> tuple[int, int]:
+        size = self.base_size / 2 ** zoom
+        return math.floor((x - self.origin_x) / size), math.floor((y - self.origin_y) / size)
+
+    def add(self, location_id: UUID, x: float, y: float):
+        """Inserts the point, moving it if it is already clustered"""
+
+        self.remove(location_id)
+        self.points[location_id] = (x, y)
+
+        for zoom, level in enumerate(self.levels):
+            cluster = level.setdefault(self._get_cell(zoom, x, y), ClusterAccumulator())
+            cluster.count += 1
+            cluster.sum_x += x
+            cluster.sum_y += y
+
+            if len(cluster.sample_ids) < self.SAMPLE_SIZE:
+                cluster.sample_ids.append(location_id)
+
+    def remove(self, location_id: UUID):
+        point = self.points.pop(location_id, None)
+
+        if point is None:
+            return
+
+        for zoom, level in enumerate(self.levels):
+            cell = self._get_cell(zoom, *point)
+            cluster = level[cell]
+            cluster.count -= 1
+
+            if cluster.count == 0:
+                del level[cell]
+                continue
+
+            cluster.sum_x -= point[0]
+            cluster.sum_y -= point[1]
+
+            if location_id in cluster.sample_ids:
+                cluster.sample_ids.remove(location_id)
+                cluster.stale = True
+
+    def _refill_samples(self, zoom: int):
+        level = self.levels[zoom]
+        stale = {cell for cell, cluster in level.items() if cluster.stale}
+
+        if not stale:
+            return
+
+        for location_id, point in self.points.items():
+            cell = self._get_cell(zoom, *point)
+
+            if cell in stale:
+                cluster = level[cell]
+                if len(cluster.sample_ids) < self.SAMPLE_SIZE and location_id not in cluster.sample_ids:
+                    cluster.sample_ids.append(location_id)
+
+        for cell in stale:
+            level[cell].stale = False
+
+    def get_clusters(
+        self,
+        zoom: int,
+        bbox: tuple[float, float, float, float] | None,
+        limit: int
+    ) -> tuple[int, list[dict]]:
+        """Returns the clusters of a zoom level, optionally only those centred in `bbox`.
+
+        Steps to coarser levels until at most `limit` clusters remain, and
+        returns the zoom it settled on; at zoom 0 the largest `limit` are kept,
+        ties broken by position.
+        """
+
+        zoom = max(0, min(zoom, len(self.levels) - 1))
+
+        while True:
+            selected = []
+
+            for cell, cluster in self.levels[zoom].items():
+                x = cluster.sum_x / cluster.count
+                y = cluster.sum_y / cluster.count
+
+                if bbox is not None and not (bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]):
+                    continue
+
+                selected.append((cluster, x, y))
+
+                if len(selected) > limit and zoom > 0:
+                    break
+
+            if len(selected) <= limit or zoom == 0:
+                break
+
+            zoom -= 1
+
+        selected = heapq.nsmallest(limit, selected, key=lambda item: (-item[0].count, item[1], item[2]))
+        self._refill_samples(zoom)
+
+        return zoom, [
+            {
+                'coord_x': x,
+                'coord_y': y,
+                'count': cluster.count,
+                'sample_ids': list(cluster.sample_ids)
+            }
+            for cluster, x, y in selected
+        ]
+
+
+class IndexEntry:
+    __slots__ = ('index', 'version', 'checked_at')
+
+    def __init__(self, index: Any | None, version: int, checked_at: float):
+        # None for a world with more than `max_points` locations
+        self.index = index
+        self.version = version
+        self.checked_at = checked_at
+
+
+class LocationIndexCache:
+    """Per-worker LRU of per-world location structures keyed by world id.
+
+    Holds `LocationGrid`s or `LocationClusters`, made by `build(db,
+    world_id, points)`. Structures are built by background tasks with the
+    CPU-bound part in an executor; until one is ready, and for worlds with
+    more than `max_points` locations, callers answer from the database.
+
+    Entries are patched in place by the location endpoints of this worker.
+    Every `ttl` seconds an entry is revalidated in the background against
+    the world's version, so changes made by other workers show up, and only
+    rebuilt when the version moved.
+    """
+
+    def __init__(self, max_points: int, ttl: float, build: Callable[[AsyncSession, UUID, list], Awaitable[Any]]):
+        self.max_points = max_points
+        self.ttl = ttl
+        self.build = build
+        self._entries: OrderedDict[UUID, IndexEntry] = OrderedDict()
+        self._tasks: dict[UUID, asyncio.Task] = {}
+
+    def peek(self, world_id: UUID) -> Any | None:
+        """The cached structure, without scheduling a build or a revalidation"""
+
+        entry = self._entries.get(world_id)
+
+        return entry.index if entry is not None else None
+
+    def get(self, world_id: UUID) -> Any | None:
+        """The cached structure, or None while it is built or if the world is too large"""
+
+        entry = self._entries.get(world_id)
+
+        if entry is None:
+            self._schedule(world_id, self._load(world_id))
+            return None
+
+        if time.monotonic() - entry.checked_at > self.ttl:
+            self._schedule(world_id, self._revalidate(world_id, entry))
+
+        self._entries.move_to_end(world_id)
+
+        return entry.index
+
+    async def wait(self, world_id: UUID) -> Any | None:
+        """Waits for a scheduled build of the world, if any, and returns the structure"""
+
+        task = self._tasks.get(world_id)
+
+        if task is not None:
+            await asyncio.shield(task)
+
+        return self.peek(world_id)
+
+    def _schedule(self, world_id: UUID, job: Coroutine):
+        if world_id in self._tasks:
+            job.close()
+            return
+
+        task = asyncio.create_task(job)
+        self._tasks[world_id] = task
+        task.add_done_callback(lambda t: self._on_done(world_id, t))
+
+    def _on_done(self, world_id: UUID, task: asyncio.Task):
+        self._tasks.pop(world_id, None)
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('building the location structure of world %s failed', world_id, exc_info=task.exception())
+
+    async def _load(self, world_id: UUID):
+        async with async_session() as db:
+            query = await db.execute(sa.select(models.World.version).where(models.World.id == world_id))
+            version = query.scalar()
+
+            if version is None:
+                return
+
+            # The version is read first, so a write in between only causes another rebuild
+            query = await db.execute(
+                sa.select(sa.func.count()).where(models.Location.world_id == world_id)
+            )
+
+            if query.scalar() > self.max_points:
+                index = None
+            else:
+                index = await self.build(db, world_id, await load_world_points(db, world_id, self.max_points))
+
+        self._put(world_id, IndexEntry(index, version, time.monotonic()))
+
+    async def _revalidate(self, world_id: UUID, entry: IndexEntry):
+        async with async_session() as db:
+            query = await db.execute(sa.select(models.World.version).where(models.World.id == world_id))
+            version = query.scalar()
+
+        if version is None:
+            self.discard(world_id)
+        elif version == entry.version:
+            entry.checked_at = time.monotonic()
+        else:
+            await self._load(world_id)
+
+    def _put(self, world_id: UUID, entry: IndexEntry):
+        self._entries[world_id] = entry
+        self._entries.move_to_end(world_id)
+
+        # An oversized world keeps a marker, so it is not reloaded on every request. Markers and
+        # empty worlds count as one point, so touching many of them evicts them like any other entry
+        total = sum(self._get_cost(cached) for cached in self._entries.values())
+        while total > self.max_points:
+            _, evicted = self._entries.popitem(last=False)
+            total -= self._get_cost(evicted)
+
+    @staticmethod
+    def _get_cost(entry: IndexEntry) -> int:
+        return max(len(entry.index), 1) if entry.index is not None else 1
+
+    def add(self, world_id: UUID, location_id: UUID, x: float, y: float):
+        """Inserts or moves a location if its world is cached"""
+
+        index = self.peek(world_id)
+        if index is not None:
+            index.add(location_id, x, y)
+
+    def remove(self, world_id: UUID, location_id: UUID):
+        index = self.peek(world_id)
+        if index is not None:
+            index.remove(location_id)
+
+    def discard(self, world_id: UUID):
+        self._entries.pop(world_id, None)
+
+
+async def load_world_points(db: AsyncSession, world_id: UUID, limit: int) -> list:
+    """Loads up to `limit` (id, coord_x, coord_y) rows of the world's locations.
+
+    Rows are streamed in chunks, so other requests run in between.
+    """
+
+    result = await db.stream(
+        sa.select(models.Location.id, models.Location.coord_x, models.Location.coord_y)
+        .where(models.Location.world_id == world_id)
+        .order_by(models.Location.id)
+        .limit(limit)
+        .execution_options(yield_per=LOAD_CHUNK_SIZE)
+    )
+    points = []
+
+    async for chunk in result.partitions():
+        points.extend(chunk)
+
+    return points
+
+
+async def _build_grid(db: AsyncSession, world_id: UUID, points: list) -> LocationGrid:
+    return await asyncio.get_running_loop().run_in_executor(None, LocationGrid, points)
+
+
+def _read_image_size(path: str) -> tuple[int, int] | None:
+    try:
+        # Only the header is read
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+async def get_map_extent(db: AsyncSession, world_id: UUID) -> MapExtent:
+    """Cluster grid of a world, spanning its map image from (0, 0).
+
+    Falls back to the bounds of the world's locations when the map image
+    cannot be read. Extents of map images are cached by world and map image,
+    so a map changed through another worker is never clustered on the old size.
+    """
+
+    query = await db.execute(sa.select(models.World.map_image).where(models.World.id == world_id))
+    map_image = query.scalar()
+    extent = _map_extents.get((world_id, map_image))
+
+    if extent is not None:
+        return extent
+
+    path = await find_file_path(map_image) if map_image else None
+    size = await asyncio.get_running_loop().run_in_executor(None, _read_image_size, path) if path else None
+
+    if size is not None:
+        extent = MapExtent(0.0, 0.0, max(size) / config.CLUSTER_BASE_CELLS)
+        _map_extents[(world_id, map_image)] = extent
+
+        while len(_map_extents) > MAX_CACHED_MAP_EXTENTS:
+            _map_extents.pop(next(iter(_map_extents)))
+
+        return extent
+
+    query = await db.execute(
+        sa.select(
+            sa.func.min(models.Location.coord_x),
+            sa.func.min(models.Location.coord_y),
+            sa.func.max(models.Location.coord_x),
+            sa.func.max(models.Location.coord_y)
+        )
+        .where(models.Location.world_id == world_id)
+    )
+    min_x, min_y, max_x, max_y = query.one()
+
+    if min_x is None:
+        return MapExtent(0.0, 0.0, 1.0)
+
+    return MapExtent(min_x, min_y, max(max_x - min_x, max_y - min_y) / config.CLUSTER_BASE_CELLS or 1.0)
+
+
+async def _build_clusters(db: AsyncSession, world_id: UUID, points: list) -> LocationClusters:
+    extent = await get_map_extent(db, world_id)
+
+    return await asyncio.get_running_loop().run_in_executor(
+        None,
+        LocationClusters,
+        points,
+        extent,
+        config.CLUSTER_MAX_ZOOM
+    )
+
+
+MAX_CACHED_MAP_EXTENTS = 10_000
+LOAD_CHUNK_SIZE = 1000
+
+_map_extents: dict[tuple[UUID, str], MapExtent] = {}
+
+location_index = LocationIndexCache(
+    max_points=config.LOCATION_INDEX_MAX_POINTS,
+    ttl=config.LOCATION_INDEX_TTL_SECONDS,
+    build=_build_grid
+)
+
+location_clusters = LocationIndexCache(
+    max_points=config.LOCATION_INDEX_MAX_POINTS,
+    ttl=config.LOCATION_INDEX_TTL_SECONDS,
+    build=_build_clusters
+)
+
+
+def add_to_location_indexes(world_id: UUID, location_id: UUID, x: float, y: float):
+    """Inserts or moves a location in the cached structures of its world"""
+
+    location_index.add(world_id, location_id, x, y)
+    location_clusters.add(world_id, location_id, x, y)
+
+
+def remove_from_location_indexes(world_id: UUID, location_id: UUID):
+    location_index.remove(world_id, location_id)
+    location_clusters.remove(world_id, location_id)
+
+
+def discard_location_indexes(world_id: UUID):
+    location_index.discard(world_id)
+    location_clusters.discard(world_id)
+
+
+async def get_nearest_location_ids(
+    db: AsyncSession,
+    world_id: UUID,
+    x: float,
+    y: float,
+    k: int
+) -> list[UUID]:
+    """Returns the ids of the k locations of the world closest to (x, y).
+
+    Served from the in-memory grid when the world is cached. Otherwise the
+    GiST index answers the query while the grid is built in the background;
+    worlds too large for the cache are always served by the index.
+    """
+
+    grid = location_index.get(world_id)
+
+    if grid is not None:
+        return grid.nearest(x, y, k)
+
+    query = await db.execute(
+        sa.select(models.Location.id)
+        .where(models.Location.world_id == world_id)
+        .order_by(get_location_point().op('<->')(sa.func.point(x, y)))
+        .limit(k)
+    )
+
+    return query.scalars().all()
+
+
+async def _aggregate_clusters(
+    db: AsyncSession,
+    world_id: UUID,
+    extent: MapExtent,
+    zoom: int,
+    bbox: tuple[float, float, float, float] | None,
+    limit: int
+) -> list[tuple]:
+    """Clusters of one zoom level, `limit + 1` of them at most (`limit` largest at zoom 0)"""
+
+    size = extent.base_size / 2 ** zoom
+    cell_x = sa.func.floor((models.Location.coord_x - extent.origin_x) / size)
+    cell_y = sa.func.floor((models.Location.coord_y - extent.origin_y) / size)
+
+    # Numbering the locations of every cell keeps the samples bounded, instead
+    # of aggregating all ids of a cell and slicing the array afterwards
+    cells = (
+        sa.select(
+            models.Location.id,
+            models.Location.coord_x,
+            models.Location.coord_y,
+            cell_x.label('cell_x'),
+            cell_y.label('cell_y'),
+            sa.func.row_number().over(partition_by=(cell_x, cell_y), order_by=models.Location.id).label('position')
+        )
+        .where(models.Location.world_id == world_id)
+    )
+
+    if bbox is not None:
+        cells = cells.where(get_bbox_filter((bbox[0] - size, bbox[1] - size, bbox[2] + size, bbox[3] + size)))
+
+    cells = cells.subquery()
+    count = sa.func.count()
+    center_x = sa.func.avg(cells.c.coord_x)
+    center_y = sa.func.avg(cells.c.coord_y)
+    sample_ids = array_agg(cells.c.id).filter(cells.c.position <= LocationClusters.SAMPLE_SIZE)
+
+    query = sa.select(count, center_x, center_y, sample_ids).group_by(cells.c.cell_x, cells.c.cell_y)
+
+    if bbox is not None:
+        query = query.having(sa.and_(center_x.between(bbox[0], bbox[2]), center_y.between(bbox[1], bbox[3])))
+
+    if zoom > 0:
+        query = query.limit(limit + 1)
+    else:
+        query = query.order_by(count.desc(), center_x, center_y).limit(limit)
+
+    data = await db.execute(query)
+
+    return data.all()
+
+
+async def aggregate_world_clusters(
+    db: AsyncSession,
+    world_id: UUID,
+    extent: MapExtent,
+    zoom: int,
+    bbox: tuple[float, float, float, float] | None,
+    limit: int
+) -> tuple[int, list[dict]]:
+    """`LocationClusters.get_clusters` computed by Postgres with GROUP BY grid cell.
+
+    With a bbox only the locations within one cell of it are aggregated,
+    which are all those of the clusters centred in it, so the GiST index
+    narrows the scan. Coarser levels never have more clusters, so when the
+    requested one has too many the finest that fits is binary searched.
+    """
+
+    zoom = max(0, min(zoom, config.CLUSTER_MAX_ZOOM))
+    rows = await _aggregate_clusters(db, world_id, extent, zoom, bbox, limit)
+
+    if len(rows) > limit:
+        # Level 0 always fits, it is truncated to the largest clusters
+        low, high = 0, zoom - 1
+        found = None
+
+        while low < high:
+            middle = (low + high + 1) // 2
+            middle_rows = await _aggregate_clusters(db, world_id, extent, middle, bbox, limit)
+
+            if len(middle_rows) <= limit:
+                low = middle
+                found = middle_rows
+            else:
+                high = middle - 1
+
+        zoom = low
+        rows = found if found is not None else await _aggregate_clusters(db, world_id, extent, 0, bbox, limit)
+
+    return zoom, [
+        {'coord_x': x, 'coord_y': y, 'count': n, 'sample_ids': sample_ids}
+        for n, x, y, sample_ids in rows
+    ]
+
+
+async def get_world_clusters(
+    db: AsyncSession,
+    world_id: UUID,
+    zoom: int,
+    bbox: tuple[float, float, float, float] | None = None
+) -> tuple[int, list[dict]]:
+    """Returns the zoom level used and the location clusters of the world at it.
+
+    Clusters are built once per world in the background and then kept up to
+    date incrementally. Until they are ready, and for worlds too large to
+    cache, Postgres aggregates them. At most CLUSTER_MAX_PER_RESPONSE are
+    returned, stepping to coarser zoom levels as needed.
+    """
+
+    limit = config.CLUSTER_MAX_PER_RESPONSE
+    clusters = location_clusters.get(world_id)
+
+    if clusters is not None:
+        return clusters.get_clusters(zoom, bbox, limit)
+
+    extent = await get_map_extent(db, world_id)
+
+    return await aggregate_world_clusters(db, world_id, extent, zoom, bbox, limit)
@@ -0,0 +1,302 @@
+import email.utils
+import mimetypes
+import os
+import re
+import stat
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Mapping, NamedTuple
+
+import aiofiles
+import aiofiles.os
+from fastapi import Request, Response, status
+from fastapi.responses import StreamingResponse
+
+from app.config import config
+from .storage import find_file_path, get_file_path
+
+
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Uploads are named after a uuid4 (older ones after its hex form) or the
+# SHA-256 of their content and variants after their source, so the bytes
+# behind such a name never change
+IMMUTABLE_NAME = re.compile(
+    r'^(?:[0-9a-f]{64}|[0-9a-f]{32}|[0-9a-f]{8}(?:-[0-9a-f]{4}){3}-[0-9a-f]{12})[._]'
+)
+CONTENT_HASH_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+class StaticFile(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+    etag: str
+    media_type: str
+    content: bytes | None
+
+
+class HotFileCache:
+    """Size-bounded in-memory LRU of small static files.
+
+    Entries are never revalidated against the disk, which is only safe for
+    immutable names. Code deleting a file in this process `discard`s it;
+    a deletion by another process, e.g. the cleanup command, is noticed by
+    checking that the file still exists once every `check_interval` seconds.
+    """
+
+    def __init__(self, max_bytes: int, max_file_bytes: int, check_interval: float):
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.check_interval = check_interval
+        self.total_bytes = 0
+        self._files: OrderedDict[str, StaticFile] = OrderedDict()
+        self._checked_at: dict[str, float] = {}
+
+    def get(self, path: str) -> StaticFile | None:
+        file = self._files.get(path)
+        if file is not None:
+            self._files.move_to_end(path)
+
+        return file
+
+    def is_check_due(self, path: str) -> bool:
+        return time.monotonic() - self._checked_at.get(path, 0) > self.check_interval
+
+    def mark_checked(self, path: str):
+        if path in self._files:
+            self._checked_at[path] = time.monotonic()
+
+    def put(self, file: StaticFile):
+        if file.content is None or file.size > self.max_file_bytes:
+            return
+
+        self.discard(file.path)
+        self._files[file.path] = file
+        self._checked_at[file.path] = time.monotonic()
+        self.total_bytes += file.size
+
+        while self.total_bytes > self.max_bytes and self._files:
+            self.discard(next(iter(self._files)))
+
+    def discard(self, path: str):
+        file = self._files.pop(path, None)
+        self._checked_at.pop(path, None)
+        if file is not None:
+            self.total_bytes -= file.size
+
+
+hot_file_cache = HotFileCache(
+    config.HOT_FILE_CACHE_MAX_BYTES,
+    config.HOT_FILE_MAX_BYTES,
+    config.HOT_FILE_CHECK_SECONDS
+)
+
+
+def is_immutable_name(path: str) -> bool:
+    return IMMUTABLE_NAME.match(os.path.basename(path)) is not None
+
+
+def get_file_etag(path: str, file_stat: os.stat_result) -> str:
+    """Strong ETag from the content hash in the name, or from mtime and size"""
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+
+    if CONTENT_HASH_NAME.match(stem):
+        return f'"{stem}"'
+
+    return f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+
+
+async def open_static_file(path: str, media_type: str | None = None) -> StaticFile | None:
+    """Stats a file and reads it into memory when it is small enough to cache.
+
+    Returns None if the file does not exist. Cached files cost no syscall,
+    except for a periodic check that they were not deleted meanwhile.
+    """
+
+    file = hot_file_cache.get(path)
+    if file is not None:
+        if not hot_file_cache.is_check_due(path):
+            return file
+
+        if await aiofiles.os.path.isfile(path):
+            hot_file_cache.mark_checked(path)
+            return file
+
+        hot_file_cache.discard(path)
+        return None
+
+    try:
+        file_stat = await aiofiles.os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    if not stat.S_ISREG(file_stat.st_mode):
+        return None
+
+    content = None
+    cacheable = is_immutable_name(path) and file_stat.st_size <= hot_file_cache.max_file_bytes
+
+    if cacheable:
+        async with aiofiles.open(path, 'rb') as f:
+            content = await f.read()
+
+    file = StaticFile(
+        path=path,
+        size=file_stat.st_size if content is None else len(content),
+        mtime=file_stat.st_mtime,
+        etag=get_file_etag(path, file_stat),
+        media_type=media_type or mimetypes.guess_type(path)[0] or 'application/octet-stream',
+        content=content
+    )
+    hot_file_cache.put(file)
+
+    return file
+
+
+async def open_stored_file(filename: str) -> StaticFile | None:
+    """`open_static_file` for an uploaded file in either storage layout"""
+
+    file = await open_static_file(get_file_path(filename))
+    if file is not None:
+        return file
+
+    path = await find_file_path(filename)
+    if path is None:
+        return None
+
+    return await open_static_file(path)
+
+
+def _parse_http_date(value: str) -> float | None:
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def is_not_modified(headers: Mapping[str, str], file: StaticFile) -> bool:
+    """Evaluates If-None-Match, falling back to If-Modified-Since"""
+
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or file.etag in tags
+
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is not None:
+        since = _parse_http_date(if_modified_since)
+        return since is not None and int(file.mtime) <= since
+
+    return False
+
+
+def _if_range_matches(headers: Mapping[str, str], file: StaticFile) -> bool:
+    if_range = headers.get('if-range')
+    if if_range is None:
+        return True
+
+    if if_range.startswith(('"', 'W/')):
+        return if_range == file.etag
+
+    return _parse_http_date(if_range) == int(file.mtime)
+
+
+def parse_range(value: str, size: int) -> tuple[int, int] | None:
+    """Parses a single `bytes=` range into inclusive offsets.
+
+    Returns None for headers that must be ignored (malformed or multiple
+    ranges), raises ValueError if the range cannot be satisfied.
+    """
+
+    unit, _, spec = value.partition('=')
+    first, separator, last = spec.strip().partition('-')
+
+    if unit.strip().lower() != 'bytes' or ',' in spec or not separator:
+        return None
+
+    if not first:
+        if not last.isdigit():
+            return None
+
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError('range not satisfiable')
+
+        return max(size - suffix, 0), size - 1
+
+    if not first.isdigit() or (last and not last.isdigit()):
+        return None
+
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError('range not satisfiable')
+
+    return start, (min(int(last), size - 1) if last else size - 1)
+
+
+async def _read_file_range(path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(start)
+        remaining = end - start + 1
+
+        while remaining > 0:
+            chunk = await f.read(min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def get_file_response(request: Request, file: StaticFile) -> Response:
+    """Serves a static file with validators, conditional and range requests"""
+
+    headers = {
+        'ETag': file.etag,
+        'Last-Modified': email.utils.formatdate(file.mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (
+            'public, max-age=31536000, immutable'
+            if is_immutable_name(file.path)
+            else 'public, no-cache'
+        ),
+    }
+
+    if is_not_modified(request.headers, file):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    status_code = status.HTTP_200_OK
+    start, end = 0, file.size - 1
+    range_header = request.headers.get('range')
+
+    if range_header is not None and _if_range_matches(request.headers, file):
+        try:
+            byte_range = parse_range(range_header, file.size)
+        except ValueError:
+            headers['Content-Range'] = f'bytes */{file.size}'
+            return Response(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers=headers)
+
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = status.HTTP_206_PARTIAL_CONTENT
+            headers['Content-Range'] = f'bytes {start}-{end}/{file.size}'
+
+    headers['Content-Length'] = str(end - start + 1)
+
+    if file.content is not None:
+        return Response(
+            file.content[start:end + 1],
+            status_code=status_code,
+            headers=headers,
+            media_type=file.media_type
+        )
+
+    return StreamingResponse(
+        _read_file_range(file.path, start, end),
+        status_code=status_code,
+        headers=headers,
+        media_type=file.media_type
+    )
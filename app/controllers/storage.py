@@ -0,0 +1,70 @@
+import hashlib
+import os
+import re
+
+import aiofiles.os
+
+
+STATIC_DIR = 'static'
+
+# uuid4 and content-hash names start with uniformly distributed hex digits
+HEX_PREFIX = re.compile(r'^[0-9a-f]{4}')
+
+
+def get_file_shard(filename: str) -> str:
+    """Two-level fan-out directory of a file, e.g. `ab/cd` for `abcd1234...png`"""
+
+    key = filename if HEX_PREFIX.match(filename) else hashlib.md5(filename.encode()).hexdigest()
+    return os.path.join(key[:2], key[2:4])
+
+
+def get_file_path(filename: str) -> str:
+    """Path a file is stored at in the sharded layout"""
+
+    return os.path.join(STATIC_DIR, get_file_shard(filename), filename)
+
+
+def get_legacy_file_path(filename: str) -> str:
+    """Path of a file that was stored before `static/` was sharded"""
+
+    return os.path.join(STATIC_DIR, filename)
+
+
+def resolve_file_path(filename: str) -> str | None:
+    """Blocking version of `find_file_path`, for the process pool and commands"""
+
+    path = get_file_path(filename)
+
+    for candidate in (path, get_legacy_file_path(filename), path):
+        if os.path.isfile(candidate):
+            return candidate
+
+    return None
+
+
+async def find_file_path(filename: str) -> str | None:
+    """Locates a stored file in the sharded layout or the legacy flat one.
+
+    Files are moved by `app.commands.shard_static` while the app is running,
+    so the sharded path is checked again after a miss on the legacy path.
+    Returns None if the file does not exist.
+    """
+
+    path = get_file_path(filename)
+
+    for candidate in (path, get_legacy_file_path(filename), path):
+        if await aiofiles.os.path.isfile(candidate):
+            return candidate
+
+    return None
+
+
+async def store_file(source: str, filename: str) -> str:
+    """Moves a finished upload into its shard, returns the new path"""
+
+    path = get_file_path(filename)
+
+    await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+    await aiofiles.os.rename(source, path)
+
+    return path
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+
+import aiofiles.os
+from PIL import Image
+
+from app.config import config
+from .images import run_in_process_pool
+from .storage import find_file_path, get_file_shard
+
+
+logger = logging.getLogger(__name__)
+
+TILES_DIR = 'static/tiles'
+
+_pending_pyramids: dict[str, asyncio.Future] = {}
+# When generating the pyramid of a file last failed, it is not retried before TILE_RETRY_SECONDS
+_failed_pyramids: dict[str, float] = {}
+
+
+def get_tiles_dir(filename: str) -> str:
+    """Directory of the pyramid of a file, sharded like the file itself"""
+
+    return os.path.join(TILES_DIR, get_file_shard(filename), filename)
+
+
+def get_legacy_tiles_dir(filename: str) -> str:
+    """Directory of a pyramid generated before `static/tiles` was sharded"""
+
+    return os.path.join(TILES_DIR, filename)
+
+
+def get_tile_path(filename: str, z: int, x: int, y: int, tiles_dir: str | None = None) -> str:
+    """Path of a tile; the tile format follows the extension of the source image"""
+
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(tiles_dir or get_tiles_dir(filename), str(z), str(x), f'{y}{extension}')
+
+
+async def find_tile_path(filename: str, z: int, x: int, y: int) -> str | None:
+    """Locates a tile in the sharded layout or the legacy flat one, None if it does not exist"""
+
+    for tiles_dir in (get_tiles_dir(filename), get_legacy_tiles_dir(filename)):
+        path = get_tile_path(filename, z, x, y, tiles_dir)
+        if await aiofiles.os.path.isfile(path):
+            return path
+
+    return None
+
+
+async def has_tile_pyramid(filename: str) -> bool:
+    for tiles_dir in (get_tiles_dir(filename), get_legacy_tiles_dir(filename)):
+        if await aiofiles.os.path.isdir(tiles_dir):
+            return True
+
+    return False
+
+
+def _get_tileable_image(image: Image.Image, image_format: str) -> Image.Image:
+    """Converts modes that `reduce` or the tile format do not support.
+
+    Palette and 1-bit images become RGB(A) or L, 16/32-bit greyscale is
+    scaled to 8 bits.
+    """
+
+    if image.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+        image = image.convert('I')
+        maximum = image.getextrema()[1]
+        scale = 255 / maximum if maximum > 255 else 1
+        image = image.point(lambda value: value * scale).convert('L')
+    elif image.mode == '1':
+        image = image.convert('L')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        has_alpha = 'transparency' in image.info or image.mode.endswith('A')
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    return image
+
+
+def generate_tile_pyramid(source: str, destination: str, tile_size: int) -> int | None:
+    """Cuts an image into a deep-zoom pyramid of `tile_size` tiles.
+
+    Level 0 fits in a single tile and the last level is the full resolution,
+    each level halving the previous one. Tiles are written to
+    `destination/{z}/{x}/{y}.{ext}`; the directory is populated under a
+    temporary name and renamed at the end, so it only appears complete.
+    Returns the deepest level, or None if the source does not exist.
+
+    Runs in the image process pool.
+    """
+
+    if not os.path.isfile(source):
+        return None
+
+    extension = os.path.splitext(source)[1].lower()
+    image_format = 'PNG' if extension == '.png' else 'JPEG'
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='.pyramid-', dir=os.path.dirname(destination))
+
+    try:
+        with Image.open(source) as image:
+            image.load()
+            image = _get_tileable_image(image, image_format)
+
+            max_level = max(0, math.ceil(math.log2(max(image.size) / tile_size)))
+
+            for level in range(max_level, -1, -1):
+                width, height = image.size
+
+                for x in range(math.ceil(width / tile_size)):
+                    column = os.path.join(workdir, str(level), str(x))
+                    os.makedirs(column)
+
+                    for y in range(math.ceil(height / tile_size)):
+                        box = (
+                            x * tile_size,
+                            y * tile_size,
+                            min((x + 1) * tile_size, width),
+                            min((y + 1) * tile_size, height)
+                        )
+                        image.crop(box).save(os.path.join(column, f'{y}{extension}'), image_format)
+
+                if level > 0:
+                    image = image.reduce(2)
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    try:
+        os.rename(workdir, destination)
+    except OSError:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+        # Another worker finished the same pyramid first
+        if not os.path.isdir(destination):
+            raise
+
+    return max_level
+
+
+def _on_pyramid_done(filename: str, future: asyncio.Future):
+    _pending_pyramids.pop(filename, None)
+
+    if not future.cancelled() and future.exception() is not None:
+        _failed_pyramids[filename] = time.monotonic()
+        logger.error('tile pyramid for %s failed', filename, exc_info=future.exception())
+
+
+def has_failed_tile_pyramid(filename: str) -> bool:
+    """Whether generating the pyramid failed within TILE_RETRY_SECONDS"""
+
+    failed_at = _failed_pyramids.get(os.path.basename(filename))
+
+    return failed_at is not None and time.monotonic() - failed_at < config.TILE_RETRY_SECONDS
+
+
+async def schedule_tile_pyramid(filename: str) -> asyncio.Future | None:
+    """Starts generating the tiles of an uploaded image in the background.
+
+    Returns None if the pyramid already exists, the image is missing or
+    the last attempt failed recently; concurrent calls for the same file
+    share one job.
+    """
+
+    filename = os.path.basename(filename)
+
+    if filename in _pending_pyramids:
+        return _pending_pyramids[filename]
+
+    if has_failed_tile_pyramid(filename):
+        return None
+
+    source = await find_file_path(filename)
+
+    if source is None or await has_tile_pyramid(filename):
+        return None
+
+    # Checked again: another request may have started the job meanwhile
+    if filename in _pending_pyramids:
+        return _pending_pyramids[filename]
+
+    future = run_in_process_pool(
+        generate_tile_pyramid,
+        source,
+        get_tiles_dir(filename),
+        config.TILE_SIZE
+    )
+    _pending_pyramids[filename] = future
+    future.add_done_callback(lambda f: _on_pyramid_done(filename, f))
+
+    return future
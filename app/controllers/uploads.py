@@ -0,0 +1,135 @@
+import hashlib
+import os
+import uuid
+from typing import NamedTuple
+
+import aiofiles
+import aiofiles.os
+from fastapi import UploadFile, status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Room for the multipart boundaries and part headers around an upload
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class StoredUpload(NamedTuple):
+    path: str
+    size: int
+    sha256: str
+
+
+async def save_upload_to_temp(file: UploadFile, directory: str, max_bytes: int) -> StoredUpload:
+    """Streams an upload into a temporary file in `directory`.
+
+    The file is copied chunk by chunk, so memory use does not depend on the
+    upload size; the SHA-256 and the size are computed in the same pass.
+    Raises UploadTooLargeError as soon as more than `max_bytes` were read.
+    The caller renames the temporary file into place.
+    """
+
+    digest = hashlib.sha256()
+    size = 0
+    path = os.path.join(directory, f'.upload-{uuid.uuid4().hex}')
+
+    try:
+        async with aiofiles.open(path, 'wb') as out_file:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+
+                if size > max_bytes:
+                    raise UploadTooLargeError(f'file exceeds the maximum size of {max_bytes} bytes')
+
+                digest.update(chunk)
+                await out_file.write(chunk)
+    except BaseException:
+        await remove_file(path)
+        raise
+
+    return StoredUpload(path, size, digest.hexdigest())
+
+
+def _get_too_large_response(max_bytes: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        content={'status': 413, 'error': f'request body exceeds the maximum size of {max_bytes} bytes'}
+    )
+
+
+class RequestSizeLimitMiddleware:
+    """Rejects request bodies larger than `max_bytes` with 413 while they are received.
+
+    Starlette spools a whole multipart body to disk before the endpoint
+    runs, so the limit in `save_upload_to_temp` alone is checked only after
+    the upload was received. A too large Content-Length is refused before
+    anything is read; a body streaming past the limit is cut off, and the
+    error the parser reports for it is replaced by the 413.
+    """
+
+    def __init__(self, app: ASGIApp, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get('content-length', '')
+
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await _get_too_large_response(self.max_bytes)(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+
+            message = await receive()
+
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLargeError(f'request body exceeds the maximum size of {self.max_bytes} bytes')
+
+            return message
+
+        async def guarded_send(message: Message):
+            nonlocal response_started
+
+            if exceeded and not response_started:
+                return
+
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLargeError:
+            if response_started:
+                raise
+
+        if exceeded and not response_started:
+            await _get_too_large_response(self.max_bytes)(scope, receive, send)
+
+
+async def remove_file(path: str):
+    """Removes a file, ignoring files that are already gone"""
+
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
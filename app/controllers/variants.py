@@ -0,0 +1,359 @@
+import asyncio
+import fcntl
+import os
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+
+from PIL import Image, ImageOps
+
+from app.config import config
+from .images import run_in_process_pool
+from .static_files import hot_file_cache
+from .storage import find_file_path, get_file_shard
+
+
+VARIANTS_DIR = 'static/variants'
+
+VARIANT_FITS = ('contain', 'cover', 'fill')
+
+# format query value -> (Pillow format, file extension, media type)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', '.webp', 'image/webp'),
+    'jpeg': ('JPEG', '.jpg', 'image/jpeg'),
+    'png': ('PNG', '.png', 'image/png'),
+}
+
+# <source stem>_<w>x<h>_<fit><extension>, see `get_variant_name`
+VARIANT_NAME = re.compile(r'^(?P<stem>.+)_\d+x\d+_(?:contain|cover|fill)\.[a-z]+$')
+
+_pending_variants: dict[str, asyncio.Future] = {}
+
+
+class VariantCache:
+    """Size-bounded LRU of the rendered variants on disk, shared by all workers.
+
+    The bytes in use are kept in a file next to the variants and updated
+    under an exclusive `flock`, so `max_bytes` bounds the directory, not
+    each worker. Recency is the mtime, refreshed at most every
+    `touch_interval` seconds on hits. When a new variant crosses the limit,
+    the directory is scanned and the least recently used variants deleted
+    until it is 10% under the limit; the scan also corrects the count for
+    variants removed by others, e.g. the cleanup command. Blocking.
+    """
+
+    LOW_WATER_MARK = 0.9
+
+    def __init__(self, directory: str, max_bytes: int, touch_interval: float = 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.touch_interval = touch_interval
+        self._lock_path = os.path.join(directory, '.lock')
+        self._usage_path = os.path.join(directory, '.usage')
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_usage(self) -> int | None:
+        try:
+            with open(self._usage_path) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_usage(self, total_bytes: int):
+        with open(self._usage_path, 'w') as f:
+            f.write(str(total_bytes))
+
+    def _list_variants(self) -> list[tuple[float, str, int]]:
+        """(mtime, path, size) of the variants on disk, least recently used first"""
+
+        variants = []
+
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                # Dot files are the lock, the usage and renders in progress
+                if name.startswith('.'):
+                    continue
+
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                variants.append((stat.st_mtime, path, stat.st_size))
+
+        return sorted(variants)
+
+    def scan(self):
+        """Counts the variants already on disk, evicting if they exceed the limit"""
+
+        with self._locked():
+            self._write_usage(sum(size for _, _, size in self._list_variants()))
+
+        self.add(0)
+
+    def touch(self, path: str) -> bool:
+        """Marks a variant as used, returns False if it does not exist"""
+
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+
+        if time.time() - mtime > self.touch_interval:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return False
+
+        return True
+
+    def add(self, size: int) -> list[str]:
+        """Records a rendered variant, returns the paths of the evicted ones"""
+
+        with self._locked():
+            total_bytes = (self._read_usage() or 0) + size
+
+            if total_bytes <= self.max_bytes:
+                self._write_usage(total_bytes)
+                return []
+
+            variants = self._list_variants()
+            total_bytes = sum(size for _, _, size in variants)
+            evicted = []
+
+            for _, path, variant_size in variants:
+                if total_bytes <= self.max_bytes * self.LOW_WATER_MARK:
+                    break
+
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+                total_bytes -= variant_size
+                evicted.append(path)
+
+            self._write_usage(total_bytes)
+
+        return evicted
+
+
+variant_cache = VariantCache(VARIANTS_DIR, config.IMAGE_VARIANT_CACHE_MAX_BYTES)
+
+
+def get_supported_variant_formats() -> set[str]:
+    Image.init()
+    return {key for key, (image_format, _, _) in VARIANT_FORMATS.items() if image_format in Image.SAVE}
+
+
+def validate_variant(
+    width: int | None,
+    height: int | None,
+    fit: str,
+    image_format: str | None
+):
+    """Raises ValueError if the variant parameters are not acceptable"""
+
+    limit = config.IMAGE_VARIANT_MAX_DIMENSION
+
+    for value in (width, height):
+        if value is not None and not 0 < value <= limit:
+            raise ValueError(f'w and h must be between 1 and {limit}')
+
+    if fit not in VARIANT_FITS:
+        raise ValueError(f'fit must be one of: {", ".join(VARIANT_FITS)}')
+
+    if image_format is not None and image_format not in get_supported_variant_formats():
+        raise ValueError(f'unsupported format: {image_format}')
+
+
+def get_variant_format(filename: str, image_format: str | None) -> tuple[str, str, str]:
+    """Pillow format, extension and media type; defaults to the source format"""
+
+    if image_format is None:
+        image_format = 'png' if filename.lower().endswith('.png') else 'jpeg'
+
+    return VARIANT_FORMATS[image_format]
+
+
+def get_variant_name(
+    filename: str,
+    width: int | None,
+    height: int | None,
+    fit: str,
+    image_format: str | None
+) -> str:
+    stem = os.path.splitext(filename)[0]
+    _, extension, _ = get_variant_format(filename, image_format)
+
+    return f'{stem}_{width or 0}x{height or 0}_{fit}{extension}'
+
+
+def remove_image_variants(filenames: list[str]) -> list[tuple[str, int]]:
+    """Deletes the rendered variants of the given source files.
+
+    Only the shards of the sources are scanned. Blocking; returns the
+    removed paths with their sizes. Workers notice the removal when their
+    index points to a missing file.
+    """
+
+    stems_by_shard: dict[str, set[str]] = {}
+    for filename in filenames:
+        stems_by_shard.setdefault(get_file_shard(filename), set()).add(os.path.splitext(filename)[0])
+
+    removed = []
+
+    for shard, stems in stems_by_shard.items():
+        try:
+            with os.scandir(os.path.join(VARIANTS_DIR, shard)) as it:
+                entries = [entry for entry in it if entry.is_file()]
+        except FileNotFoundError:
+            continue
+
+        for entry in entries:
+            match = VARIANT_NAME.match(entry.name)
+            if match is None or match['stem'] not in stems:
+                continue
+
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue
+
+            removed.append((entry.path, size))
+
+    return removed
+
+
+def render_image_variant(
+    source: str,
+    destination: str,
+    width: int | None,
+    height: int | None,
+    fit: str,
+    image_format: str
+) -> int:
+    """Resizes an image and writes it atomically, returns the written size.
+
+    `contain` fits the image inside the box without upscaling, `cover` crops
+    it to fill the box, `fill` stretches it. Runs in the image process pool.
+    """
+
+    with Image.open(source) as image:
+        image.load()
+
+        source_width, source_height = image.size
+        if width is None and height is None:
+            width, height = source_width, source_height
+        elif width is None:
+            width = max(1, round(source_width * height / source_height))
+        elif height is None:
+            height = max(1, round(source_height * width / source_width))
+
+        if fit == 'cover':
+            image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        elif fit == 'fill':
+            image = image.resize((width, height), Image.LANCZOS)
+        else:
+            image.thumbnail((width, height), Image.LANCZOS)
+
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA')
+
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.variant-', dir=os.path.dirname(destination))
+        os.close(fd)
+
+        try:
+            image.save(temp_path, image_format)
+            os.replace(temp_path, destination)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    return os.path.getsize(destination)
+
+
+async def _render_and_record_variant(
+    source: str,
+    destination: str,
+    width: int | None,
+    height: int | None,
+    fit: str,
+    image_format: str
+):
+    """Renders a variant in the process pool and counts it once in the cache"""
+
+    size = await run_in_process_pool(
+        render_image_variant,
+        source,
+        destination,
+        width,
+        height,
+        fit,
+        image_format
+    )
+
+    for evicted_path in await asyncio.to_thread(variant_cache.add, size):
+        hot_file_cache.discard(evicted_path)
+
+
+async def get_image_variant(
+    filename: str,
+    width: int | None,
+    height: int | None,
+    fit: str,
+    image_format: str | None
+) -> tuple[str, str]:
+    """Returns the path and media type of a resized variant of an uploaded image.
+
+    The variant is rendered once in the process pool; concurrent requests for
+    the same variant wait on the same job. Raises FileNotFoundError if the
+    image does not exist.
+    """
+
+    # Variants are sharded like their source, see `remove_image_variants`
+    name = os.path.join(get_file_shard(filename), get_variant_name(filename, width, height, fit, image_format))
+    path = os.path.join(VARIANTS_DIR, name)
+    pillow_format, _, media_type = get_variant_format(filename, image_format)
+
+    if await asyncio.to_thread(variant_cache.touch, path):
+        return path, media_type
+
+    future = _pending_variants.get(name)
+
+    if future is None:
+        source = await find_file_path(filename)
+
+        if source is None:
+            raise FileNotFoundError(filename)
+
+        # Checked again: another request may have started the job meanwhile
+        future = _pending_variants.get(name)
+
+    if future is None:
+        future = asyncio.create_task(
+            _render_and_record_variant(source, path, width, height, fit, pillow_format)
+        )
+        _pending_variants[name] = future
+        future.add_done_callback(lambda f: _pending_variants.pop(name, None))
+
+    # Shielded so a disconnecting client does not cancel the job for the others
+    await asyncio.shield(future)
+
+    return path, media_type
@@ -0,0 +1,168 @@
+from typing import Iterable, Mapping
+from uuid import UUID
+
+import sqlalchemy as sa
+from fastapi import Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from .loading import LOCATION_EXPANSIONS, WORLD_EXPANSIONS
+
+
+def get_version_etag(version: int, creators: tuple[int, int] = (0, 0)) -> str:
+    """ETag of a version of a world, location or user.
+
+    `creators` is the count and the sum of the versions of the users the
+    response embeds: a user is never embedded without the embedding row
+    changing, and a user only ever gains versions, so the pair changes with
+    every edit of an embedded profile. The ETag is weak because it names
+    the data, not the bytes of one rendering of it.
+    """
+
+    count, total = creators
+
+    if count == 0:
+        return f'W/"{version}"'
+
+    return f'W/"{version}.{count}.{total}"'
+
+
+def _sum_creator_versions(creators: Iterable['models.User | None']) -> tuple[int, int]:
+    versions = {creator.id: creator.version for creator in creators if creator is not None}
+
+    return len(versions), sum(versions.values())
+
+
+def _select_creator_versions(creator_ids):
+    return (
+        sa.select(sa.func.count(), sa.func.coalesce(sa.func.sum(models.User.version), 0))
+        .where(models.User.id.in_(creator_ids))
+        .subquery()
+    )
+
+
+def is_etag_matched(headers: Mapping[str, str], etag: str) -> bool:
+    """Evaluates If-None-Match with the weak comparison"""
+
+    if_none_match = headers.get('if-none-match')
+
+    if if_none_match is None:
+        return False
+
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+def get_not_modified_response(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+
+async def get_version(db: AsyncSession, model, id: UUID) -> int | None:
+    """Reads only the version column of a row, None if there is no such row"""
+
+    query = await db.execute(sa.select(model.version).where(model.id == id))
+
+    return query.scalar()
+
+
+def get_rendered_world_etag(world: 'models.World') -> str:
+    """ETag of a world loaded with `get_world_out_options`"""
+
+    creators = []
+    state = sa.inspect(world)
+
+    if 'creator' not in state.unloaded:
+        creators.append(world.creator)
+    if 'locations' not in state.unloaded:
+        creators.extend(
+            location.creator
+            for location in world.locations
+            if 'creator' not in sa.inspect(location).unloaded
+        )
+
+    return get_version_etag(world.version, _sum_creator_versions(creators))
+
+
+def get_rendered_location_etag(location: 'models.Location') -> str:
+    """ETag of a location loaded with `get_location_out_options`"""
+
+    creators = [] if 'creator' in sa.inspect(location).unloaded else [location.creator]
+
+    return get_version_etag(location.version, _sum_creator_versions(creators))
+
+
+async def get_world_etag(db: AsyncSession, id: UUID, expand: set[str] | None) -> str | None:
+    """`get_rendered_world_etag` from the version columns alone, None if there is no such world"""
+
+    expand = set(WORLD_EXPANSIONS) if expand is None else expand
+    creator_ids = []
+
+    if 'creator' in expand:
+        creator_ids.append(sa.select(models.World.creator_id).where(models.World.id == id))
+        if 'locations' in expand:
+            creator_ids.append(sa.select(models.Location.creator_id).where(models.Location.world_id == id))
+
+    if not creator_ids:
+        return await _get_plain_etag(db, models.World, id)
+
+    creators = _select_creator_versions(sa.union(*creator_ids) if len(creator_ids) > 1 else creator_ids[0])
+    query = await db.execute(sa.select(models.World.version, *creators.c).where(models.World.id == id))
+    row = query.first()
+
+    return None if row is None else get_version_etag(row[0], (row[1], row[2]))
+
+
+async def get_location_etag(db: AsyncSession, id: UUID, expand: set[str] | None) -> str | None:
+    """`get_rendered_location_etag` from the version columns alone, None if there is no such location"""
+
+    expand = set(LOCATION_EXPANSIONS) if expand is None else expand
+
+    if 'creator' not in expand:
+        return await _get_plain_etag(db, models.Location, id)
+
+    creators = _select_creator_versions(sa.select(models.Location.creator_id).where(models.Location.id == id))
+    query = await db.execute(sa.select(models.Location.version, *creators.c).where(models.Location.id == id))
+    row = query.first()
+
+    return None if row is None else get_version_etag(row[0], (row[1], row[2]))
+
+
+async def _get_plain_etag(db: AsyncSession, model, id: UUID) -> str | None:
+    version = await get_version(db, model, id)
+
+    return None if version is None else get_version_etag(version)
+
+
+async def bump_world_version(db: AsyncSession, world_id: UUID):
+    """Bumps the version in the caller's transaction"""
+
+    await db.execute(
+        sa.update(models.World)
+        .where(models.World.id == world_id)
+        .values(version=models.World.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def bump_location_version(db: AsyncSession, location_id: UUID):
+    """Bumps the version of a location and of its world in the caller's transaction"""
+
+    await db.execute(
+        sa.update(models.Location)
+        .where(models.Location.id == location_id)
+        .values(version=models.Location.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(
+        sa.update(models.World)
+        .where(
+            models.World.id == (
+                sa.select(models.Location.world_id)
+                .where(models.Location.id == location_id)
+                .scalar_subquery()
+            )
+        )
+        .values(version=models.World.version + 1)
+        .execution_options(synchronize_session=False)
+    )
@@ -1,29 +1,41 @@
+import asyncio
 import os
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from app import views
+from app import controllers, views
+from app.config import config
 
 
 app = FastAPI(title='ITForDesigners')
 
+app.add_middleware(
+    controllers.RequestSizeLimitMiddleware,
+    max_bytes=config.UPLOAD_MAX_BYTES + controllers.MULTIPART_OVERHEAD_BYTES,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['*'],
     allow_credentials=True,
     allow_methods=['*'],
     allow_headers=['*'],
+    expose_headers=['X-Next-Cursor', 'X-Cluster-Zoom', 'ETag', 'Retry-After'],
 )
+app.middleware('http')(controllers.read_your_writes_middleware)
 
 @app.on_event('startup')
 async def startup():
     if not os.path.isdir('static'):
         os.mkdir('static')
 
+    await asyncio.to_thread(controllers.variant_cache.scan)
+    controllers.start_popular_worlds_refresher()
+
 @app.on_event('shutdown')
 async def shutdown():
-    ...
+    controllers.stop_popular_worlds_refresher()
+    controllers.shutdown_process_pool()
 
 
 app.include_router(views.auth_router, prefix='/api')
@@ -31,3 +43,4 @@ app.include_router(views.users_router, prefix='/api')
 app.include_router(views.worlds_router, prefix='/api')
 app.include_router(views.locations_router, prefix='/api')
 app.include_router(views.files_router, prefix='/api')
+app.include_router(views.stats_router, prefix='/api')
@@ -8,12 +8,19 @@ from app.controllers.database import Base
 
 class File(Base):
     __tablename__ = 'files'
+    __table_args__ = (
+        sa.Index('ix_files_uploaded_at_filename', 'uploaded_at', 'filename'),
+    )
 
     filename = sa.Column(sa.String, primary_key=True, nullable=False)
     author_id = sa.Column(UUID(as_uuid=True), sa.ForeignKey('users.id', ondelete='SET NULL'))
     uploaded_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('NOW()'))
+    # Refreshed when the same content is uploaded again, the cleanup grace period starts from it
+    last_uploaded_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('NOW()'))
+    sha256 = sa.Column(sa.String(64), index=True)
+    size = sa.Column(sa.BigInteger)
 
-    author = relationship('User', lazy='joined')
+    author = relationship('User', lazy='raise_on_sql')
 
     def __repr__(self) -> str:
         return (
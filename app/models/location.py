@@ -10,6 +10,11 @@ from app.controllers.database import Base
 
 class Location(Base):
     __tablename__ = 'locations'
+    __table_args__ = (
+        sa.Index('ix_locations_created_at_id', 'created_at', 'id'),
+        sa.Index('ix_locations_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        sa.Index('ix_locations_description_trgm', 'description', postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'}),
+    )
 
     id = sa.Column(UUID(as_uuid=True), primary_key=True, nullable=False, default=uuid.uuid4)
     name = sa.Column(sa.String, nullable=False)
@@ -19,9 +24,11 @@ class Location(Base):
     created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('NOW()'))
     coord_x = sa.Column(sa.Float(precision=8), nullable=False)
     coord_y = sa.Column(sa.Float(precision=8), nullable=False)
+    # Bumped by every write to the location and its images, see controllers.versions
+    version = sa.Column(sa.Integer, nullable=False, server_default=text('1'))
 
-    creator = relationship('User', lazy='joined')
-    images = relationship('LocationImage', lazy='joined')
+    creator = relationship('User', lazy='raise_on_sql')
+    images = relationship('LocationImage', lazy='raise_on_sql')
 
     def __repr__(self) -> str:
         return (
@@ -51,3 +58,13 @@ class LocationImage(Base):
         )
 
     __mapper_args__ = {'eager_defaults': True}
+
+
+# Serves bounding-box (<@) and nearest-neighbour (<->) lookups within a world.
+# Needs the btree_gist extension for the uuid column.
+sa.Index(
+    'ix_locations_world_id_point',
+    Location.world_id,
+    sa.func.point(Location.coord_x, Location.coord_y),
+    postgresql_using='gist'
+)
@@ -10,6 +10,13 @@ from app.controllers.database import Base
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        sa.Index('ix_users_created_at_id', 'created_at', 'id'),
+        sa.Index('ix_users_first_name_trgm', 'first_name', postgresql_using='gin', postgresql_ops={'first_name': 'gin_trgm_ops'}),
+        sa.Index('ix_users_last_name_trgm', 'last_name', postgresql_using='gin', postgresql_ops={'last_name': 'gin_trgm_ops'}),
+        sa.Index('ix_users_additional_name_trgm', 'additional_name', postgresql_using='gin', postgresql_ops={'additional_name': 'gin_trgm_ops'}),
+        sa.Index('ix_users_username_trgm', 'username', postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'}),
+    )
 
     id = sa.Column(UUID(as_uuid=True), primary_key=True, nullable=False, default=uuid.uuid4)
     username = sa.Column(sa.String, nullable=False, unique=True)
@@ -20,11 +27,13 @@ class User(Base):
     phone_number = sa.Column(sa.String(15))
     email = sa.Column(sa.String, nullable=False, unique=True)
     password = sa.Column(sa.String, nullable=False)
-    avatar_image = sa.Column(sa.String)
+    avatar_image = sa.Column(sa.String, index=True)
     created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('NOW()'))
+    # Bumped by every write to the user, see controllers.versions
+    version = sa.Column(sa.Integer, nullable=False, server_default=text('1'))
 
-    worlds = relationship('World', lazy='joined', primaryjoin='User.id==World.creator_id', viewonly=True)
-    locations = relationship('Location', lazy='joined', primaryjoin='User.id==Location.creator_id', viewonly=True)
+    worlds = relationship('World', lazy='raise_on_sql', primaryjoin='User.id==World.creator_id', viewonly=True)
+    locations = relationship('Location', lazy='raise_on_sql', primaryjoin='User.id==Location.creator_id', viewonly=True)
 
     def __repr__(self) -> str:
         return (
@@ -10,17 +10,26 @@ from ..controllers.database import Base
 
 class World(Base):
     __tablename__ = 'worlds'
+    __table_args__ = (
+        sa.Index('ix_worlds_created_at_id', 'created_at', 'id'),
+        sa.Index('ix_worlds_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        sa.Index('ix_worlds_description_trgm', 'description', postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'}),
+    )
 
     id = sa.Column(UUID(as_uuid=True), primary_key=True, nullable=False, default=uuid.uuid4)
     name = sa.Column(sa.String, nullable=False)
     description = sa.Column(sa.String)
-    cover_image = sa.Column(sa.String)
-    map_image = sa.Column(sa.String, nullable=False)
+    cover_image = sa.Column(sa.String, index=True)
+    map_image = sa.Column(sa.String, nullable=False, index=True)
     creator_id = sa.Column(UUID(as_uuid=True), sa.ForeignKey('users.id', ondelete='SET NULL'))
     created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('NOW()'))
+    # Maintained by favourite_world/unfavourite_world, see controllers.reconcile_favourite_counts
+    favourite_count = sa.Column(sa.Integer, nullable=False, server_default=text('0'), index=True)
+    # Bumped by every write to the world, its locations and their images, see controllers.versions
+    version = sa.Column(sa.Integer, nullable=False, server_default=text('1'))
 
-    creator = relationship('User', lazy='joined')
-    locations = relationship('Location', lazy='joined')
+    creator = relationship('User', lazy='raise_on_sql')
+    locations = relationship('Location', lazy='raise_on_sql')
 
     def __repr__(self) -> str:
         return (
@@ -38,6 +47,7 @@ class FavouriteWorld(Base):
 
     world_id = sa.Column(UUID(as_uuid=True), sa.ForeignKey('worlds.id', ondelete='CASCADE'), primary_key=True)
     user_id = sa.Column(UUID(as_uuid=True), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    created_at = sa.Column(sa.TIMESTAMP(timezone=True), nullable=False, server_default=text('NOW()'), index=True)
 
     def __repr__(self) -> str:
         return (
@@ -3,4 +3,5 @@ from .token import *
 from .user import *
 from .world import *
 from .location import *
+from .stats import *
 from .util import *
@@ -5,6 +5,7 @@ from pydantic import BaseModel, validator
 
 from app.config import config
 from .user import UserOutPublic
+from .util import LoadedGetterDict
 
 
 class LocationImageIn(BaseModel):
@@ -47,6 +48,35 @@ class LocationOut(LocationCreated):
     images: list[LocationImageOut]
 
 
+class LocationSparse(BaseModel):
+    """`LocationOut` restricted to the columns and relationships that were loaded"""
+
+    name: str | None
+    description: str | None
+    world_id: UUID | None
+    coord_x: float | None
+    coord_y: float | None
+    id: UUID | None
+    created_at: datetime | None
+    creator: UserOutPublic | None
+    images: list[LocationImageOut] | None
+
+    class Config:
+        orm_mode = True
+        getter_dict = LoadedGetterDict
+
+
+class LocationBatchCreated(BaseModel):
+    ids: list[UUID]
+
+
+class LocationCluster(BaseModel):
+    coord_x: float
+    coord_y: float
+    count: int
+    sample_ids: list[UUID]
+
+
 class LocationUpdate(BaseModel):
     name: str | None
     description: str | None
@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+
+
+class DatabasePoolStatus(BaseModel):
+    name: str
+    size: int
+    checked_out: int
+    idle: int
+    overflow: int
+    max_overflow: int
+    checkouts: int
+    overflow_checkouts: int
+    timeouts: int
+    max_wait_seconds: float
+    wait_seconds_histogram: dict[str, int]
+
+
+class PasswordHashStatus(BaseModel):
+    workers: int
+    jobs: int
+    pending: int
+    mean_queue_seconds: float
+    max_queue_seconds: float
@@ -1,6 +1,21 @@
+import sqlalchemy as sa
 from pydantic import BaseModel
+from pydantic.utils import GetterDict
 
 
 class ResponseError(BaseModel):
     status: int
     error: str
+
+
+class LoadedGetterDict(GetterDict):
+    """Exposes only the attributes that were loaded from the database.
+
+    Used by sparse schemas: columns excluded with `load_only` and relationships
+    that were not eager loaded are treated as missing instead of lazy loading.
+    """
+
+    def get(self, key, default=None):
+        if key in sa.inspect(self._obj).unloaded:
+            return default
+        return getattr(self._obj, key, default)
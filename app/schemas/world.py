@@ -4,8 +4,9 @@ from uuid import UUID
 from pydantic import BaseModel, validator
 
 from app.config import config
-from .location import LocationOut
+from .location import LocationOut, LocationSparse
 from .user import UserOutPublic
+from .util import LoadedGetterDict
 
 
 class BaseWorld(BaseModel):
@@ -26,6 +27,7 @@ class WorldCreated(BaseWorld):
     id: UUID
     created_at: datetime
     creator: UserOutPublic | None
+    favourite_count: int = 0
 
     @validator('map_image', 'cover_image')
     def format_image_url(cls, value) -> str:
@@ -38,6 +40,31 @@ class WorldOut(WorldCreated):
     locations: list[LocationOut] | None
 
 
+class WorldSparse(BaseModel):
+    """`WorldOut` restricted to the columns and relationships that were loaded"""
+
+    name: str | None
+    description: str | None
+    map_image: str | None
+    cover_image: str | None
+    id: UUID | None
+    created_at: datetime | None
+    favourite_count: int | None
+    is_favourite: bool | None
+    creator: UserOutPublic | None
+    locations: list[LocationSparse] | None
+
+    class Config:
+        orm_mode = True
+        getter_dict = LoadedGetterDict
+
+    @validator('map_image', 'cover_image')
+    def format_image_url(cls, value) -> str:
+        if value is None:
+            return value
+        return config.STATIC_STORAGE_BASE_URL + value if config.STATIC_STORAGE_BASE_URL not in value else value
+
+
 class WorldUpdate(BaseModel):
     name: str | None
     description: str | None
@@ -1,6 +1,72 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
 from passlib.context import CryptContext
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+from app.config import config
+
+
+logger = logging.getLogger(__name__)
+
+# Hashes made with another number of rounds are reported by verify_and_update,
+# so changing BCRYPT_ROUNDS rehashes passwords as users log in
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto', bcrypt__rounds=config.BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so threads hash in parallel with the event loop
+_password_executor = ThreadPoolExecutor(
+    max_workers=config.PASSWORD_HASH_WORKERS,
+    thread_name_prefix='password-hash'
+)
+_password_slots = asyncio.Semaphore(config.PASSWORD_HASH_MAX_PENDING)
+
+
+class PasswordHashStats:
+    """Queue-time metrics of the password hashing pool.
+
+    Jobs are recorded from the pool threads, so updates take a lock.
+    """
+
+    def __init__(self):
+        self.jobs = 0
+        self.pending = 0
+        self.total_queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def submitted(self):
+        with self._lock:
+            self.pending += 1
+
+    def finished(self):
+        with self._lock:
+            self.pending -= 1
+
+    def record(self, queue_seconds: float):
+        with self._lock:
+            self.jobs += 1
+            self.total_queue_seconds += queue_seconds
+            self.max_queue_seconds = max(self.max_queue_seconds, queue_seconds)
+            pending = self.pending
+
+        if queue_seconds > config.PASSWORD_HASH_SLOW_QUEUE_SECONDS:
+            logger.warning('password hashing waited %.3fs in the queue, %d pending', queue_seconds, pending)
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'workers': config.PASSWORD_HASH_WORKERS,
+                'jobs': self.jobs,
+                'pending': self.pending,
+                'mean_queue_seconds': self.total_queue_seconds / self.jobs if self.jobs else 0.0,
+                'max_queue_seconds': self.max_queue_seconds,
+            }
+
+
+password_hash_stats = PasswordHashStats()
 
 
 def get_password_hash(password: str) -> str:
@@ -9,3 +75,36 @@ def get_password_hash(password: str) -> str:
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
+
+
+async def _run_password_job(func: Callable, *args) -> Any:
+    """Runs a bcrypt call in the pool, at most PASSWORD_HASH_MAX_PENDING at a time"""
+
+    submitted_at = time.monotonic()
+    password_hash_stats.submitted()
+
+    def job():
+        password_hash_stats.record(time.monotonic() - submitted_at)
+        return func(*args)
+
+    try:
+        async with _password_slots:
+            return await asyncio.get_running_loop().run_in_executor(_password_executor, job)
+    finally:
+        password_hash_stats.finished()
+
+
+async def hash_password(password: str) -> str:
+    """`get_password_hash` off the event loop"""
+
+    return await _run_password_job(get_password_hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Verifies a password off the event loop.
+
+    Also returns a new hash when the stored one uses outdated settings,
+    otherwise None.
+    """
+
+    return await _run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
@@ -1,5 +1,6 @@
 from .auth import router as auth_router
 from .files import router as files_router
 from .locations import router as locations_router
+from .stats import router as stats_router
 from .users import router as users_router
 from .worlds import router as worlds_router
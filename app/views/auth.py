@@ -1,12 +1,12 @@
 import sqlalchemy as sa
 
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, Request, status
 from fastapi.responses import JSONResponse
 from fastapi.security.oauth2 import OAuth2PasswordRequestForm
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import models, schemas, utils
+from app import models, schemas, utils, controllers
 from app.controllers import database, oauth2
 
 router = APIRouter(
@@ -36,7 +36,7 @@ async def create_user(
 ):
     """Creates a new user"""
 
-    hashed_password = utils.get_password_hash(body.password)
+    hashed_password = await utils.hash_password(body.password)
     body.password = hashed_password
 
     user = models.User(**body.dict())
@@ -73,14 +73,33 @@ async def create_user(
             'model': schemas.ResponseError,
             'description': 'Invalid credentials'
         },
+        429: {
+            'model': schemas.ResponseError,
+            'description': 'Too many login attempts from the client or for the user'
+        },
     }
 )
 async def login_user(
+    request: Request,
     credentials: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(database.get_session)
 ):
     """Login for access token"""
 
+    # Checked before the user lookup and bcrypt, which is what a burst of
+    # attempts would exhaust
+    retry_after = await controllers.check_login_rate_limit(
+        request.client.host if request.client else 'unknown',
+        credentials.username
+    )
+
+    if retry_after is not None:
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={'status': 429, 'error': 'too many login attempts'},
+            headers={'Retry-After': str(retry_after)}
+        )
+
     query = await db.execute(
         sa.select(models.User.id, models.User.password)
         .where(
@@ -100,13 +119,25 @@ async def login_user(
             headers={'WWW-Authenticate': 'Bearer'}
         )
 
-    if not utils.verify_password(credentials.password, user.password):
+    is_valid, new_hash = await utils.verify_and_update_password(credentials.password, user.password)
+
+    if not is_valid:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
             content={'status': 401, 'error': 'invalid credentials'},
             headers={'WWW-Authenticate': 'Bearer'}
         )
 
+    if new_hash is not None:
+        # The hash settings changed since the password was set; the check on
+        # the old hash keeps a concurrent password change from being undone
+        await db.execute(
+            sa.update(models.User)
+            .where(models.User.id == user.id, models.User.password == user.password)
+            .values(password=new_hash)
+        )
+        await db.commit()
+
     access_token = oauth2.create_access_token(data = {'user_id': str(user.id)})
 
     return schemas.Token(access_token=access_token, token_type='bearer')
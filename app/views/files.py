@@ -1,13 +1,12 @@
-import os
-import uuid
-
-import aiofiles
 import sqlalchemy as sa
-from fastapi import APIRouter, Depends, File, UploadFile, status
+from fastapi import APIRouter, Depends, File, Query, Request, Response, UploadFile, status
 from fastapi.responses import FileResponse, JSONResponse
+from PIL import UnidentifiedImageError
+from sqlalchemy.dialects.postgresql import insert as psql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import models, schemas
+from app import models, schemas, controllers
+from app.config import config
 from app.controllers import database, oauth2
 
 router = APIRouter(
@@ -18,21 +17,41 @@ router = APIRouter(
 
 @router.get(
     '/',
-    response_model=list[schemas.FileOutWithStorageUrl]
+    response_model=list[schemas.FileOutWithStorageUrl],
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid pagination cursor'
+        },
+    }
 )
 async def get_all_files(
-    db: AsyncSession = Depends(database.get_session),
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_session),
     limit: int | None = None,
     offset: int | None = None,
+    cursor: str | None = None,
 ):
     """Returns a list of all files"""
 
-    query = await db.execute(
-        sa.select(models.File).
-        limit(limit).
-        offset(offset)
-    )
+    limit = controllers.get_page_limit(limit)
+    keys = (models.File.uploaded_at, models.File.filename)
+
+    try:
+        statement = controllers.paginate(sa.select(models.File), keys, limit, offset, cursor)
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid cursor'}
+        )
+
+    query = await db.execute(statement)
     files = query.scalars().unique().all()
+
+    next_cursor = controllers.get_next_cursor(files, keys, limit)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
     return [schemas.FileOutWithStorageUrl.from_orm(file) for file in files]
 
 
@@ -45,6 +64,10 @@ async def get_all_files(
             'model': schemas.ResponseError,
             'description': 'Bad request. Unsupported file extension.'
         },
+        413: {
+            'model': schemas.ResponseError,
+            'description': 'The file exceeds the maximum upload size.'
+        },
         500: {
             'model': schemas.ResponseError,
             'description': 'Internal server error'
@@ -53,12 +76,12 @@ async def get_all_files(
 )
 async def upload_file(
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user),   
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal),   
     file: UploadFile = File(...)
 ):
     """Uploads file to the server"""
 
-    allowed_content_type = ('image/png', 'image/jpg', 'image/jpeg')
+    allowed_content_type = {'image/png': 'png', 'image/jpg': 'jpg', 'image/jpeg': 'jpg'}
 
     if file.content_type not in allowed_content_type:
         return JSONResponse(
@@ -69,25 +92,67 @@ async def upload_file(
             }
         )
 
-    filename = (uuid.uuid4().hex + '.' + file.filename.split('.')[-1]).lower()
+    try:
+        upload = await controllers.save_upload_to_temp(file, controllers.STATIC_DIR, config.UPLOAD_MAX_BYTES)
+    except controllers.UploadTooLargeError as e:
+        return JSONResponse(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            content={'status': 413, 'error': str(e)}
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={
+                'status': 500,
+                'error': f'something went wrong: {e}'
+            }
+        )
+
+    # Files are content-addressed: identical bytes share one file and one row.
+    # The row keeps the first uploader, the response describes the caller's upload
+    filename = f'{upload.sha256}.{allowed_content_type[file.content_type]}'
+    path = None
 
     try:
-        async with aiofiles.open(f'static/{filename}', 'wb') as out_file:
-            content = await file.read()
-            await out_file.write(content)
+        statement = (
+            psql_insert(models.File)
+            .values(
+                filename=filename,
+                author_id=current_user.id,
+                sha256=upload.sha256,
+                size=upload.size
+            )
+            .on_conflict_do_update(
+                index_elements=['filename'],
+                set_={'last_uploaded_at': sa.func.now()}
+            )
+            .returning(models.File)
+        )
+        query = (
+            sa.select(models.File)
+            .from_statement(statement)
+            .execution_options(populate_existing=True)
+        )
+        data = await db.execute(query)
+        image = data.scalars().first()
 
-        image_data = {
-            'filename': filename, 
-            'author_id': current_user.id
-        }
+        if await controllers.find_file_path(filename) is None:
+            path = await controllers.store_file(upload.path, filename)
+        else:
+            await controllers.remove_file(upload.path)
 
-        image = models.File(**image_data)
-        db.add(image)
         await db.commit()
-        return schemas.FileOut.from_orm(image)
+        return schemas.FileOut(
+            filename=image.filename,
+            author_id=current_user.id,
+            uploaded_at=image.last_uploaded_at
+        )
 
     except Exception as e:
         await db.rollback()
+        await controllers.remove_file(upload.path)
+        if path is not None:
+            await controllers.remove_file(path)
         return JSONResponse(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             content={
@@ -101,21 +166,124 @@ async def upload_file(
     '/{filename}',
     response_class=FileResponse,
     responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid resize parameters or the file is not an image.'
+        },
         404: {
             'model': schemas.ResponseError,
             'description': 'File not found.'
-        }
+        },
+        500: {
+            'model': schemas.ResponseError,
+            'description': 'Internal server error'
+        },
     }
 )
 async def get_single_file(
-    filename: str
+    request: Request,
+    filename: str,
+    w: int | None = None,
+    h: int | None = None,
+    fit: str = 'contain',
+    image_format: str | None = Query(None, alias='format'),
 ):
-    """Returns a file"""
+    """Returns a file, or a resized variant of an image when `w`, `h` or `format` is passed"""
+
+    if w is None and h is None and image_format is None:
+        file = await controllers.open_stored_file(filename)
 
-    if not os.path.exists(f'static/{filename}'):
+        if file is None:
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={'status': 404, 'error': f'file {filename} was not found'}
+            )
+
+        return controllers.get_file_response(request, file)
+
+    try:
+        controllers.validate_variant(w, h, fit, image_format)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': str(e)}
+        )
+
+    try:
+        path, media_type = await controllers.get_image_variant(filename, w, h, fit, image_format)
+    except FileNotFoundError:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={'status': 404, 'error': f'file {filename} was not found'}
+        )
+    except UnidentifiedImageError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'file {filename} is not an image'}
+        )
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={
+                'status': 500,
+                'error': f'something went wrong: {e}'
+            }
+        )
+
+    file = await controllers.open_static_file(path, media_type)
+
+    if file is None:
         return JSONResponse(
             status_code=status.HTTP_404_NOT_FOUND,
             content={'status': 404, 'error': f'file {filename} was not found'}
         )
 
-    return FileResponse(f'static/{filename}')
+    return controllers.get_file_response(request, file)
+
+
+@router.get(
+    '/{filename}/tiles/{z}/{x}/{y}',
+    response_class=FileResponse,
+    responses={
+        404: {
+            'model': schemas.ResponseError,
+            'description': 'Tile not found or the tiles are not generated yet.'
+        }
+    }
+)
+async def get_map_tile(
+    filename: str,
+    z: int,
+    x: int,
+    y: int,
+    db: AsyncSession = Depends(database.get_read_session)
+):
+    """Returns a tile of a world map image"""
+
+    path = await controllers.find_tile_path(filename, z, x, y)
+
+    if path is not None:
+        return FileResponse(
+            path,
+            headers={'Cache-Control': 'public, max-age=31536000, immutable'}
+        )
+
+    if (
+        not controllers.has_failed_tile_pyramid(filename)
+        and not await controllers.has_tile_pyramid(filename)
+    ):
+        # Pyramids are generated when a file is used as a map; catch up on
+        # maps that were set before tiling existed
+        query = await db.execute(
+            sa.select(models.World.id)
+            .where(models.World.map_image == filename)
+            .limit(1)
+        )
+
+        if query.scalar() is not None:
+            await controllers.schedule_tile_pyramid(filename)
+
+    return JSONResponse(
+        status_code=status.HTTP_404_NOT_FOUND,
+        content={'status': 404, 'error': f'tile {z}/{x}/{y} of {filename} was not found'}
+    )
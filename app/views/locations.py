@@ -1,7 +1,8 @@
+import time
 from uuid import UUID
 
 import sqlalchemy as sa
-from fastapi import APIRouter, Depends, Response, status
+from fastapi import APIRouter, Depends, Request, Response, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -17,35 +18,90 @@ router = APIRouter(
 
 @router.get(
     '/',
-    response_model=list[schemas.LocationOut]
+    response_model=list[schemas.LocationSparse],
+    response_model_exclude_unset=True,
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid pagination cursor, fields or expand'
+        },
+    }
 )
 async def get_all_locations(
-    db: AsyncSession = Depends(database.get_session),
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_session),
     search: str | None = None,
     limit: int | None = None,
     offset: int | None = None,
+    cursor: str | None = None,
+    fields: str | None = None,
+    expand: str | None = None,
 ):
-    """Returns a list of all locations"""
+    """Returns a list of all locations.
 
-    search = search if search else ''
-    query = await db.execute(
-        sa.select(models.Location).
-        where(sa.or_(
-            models.Location.name.contains(search),
-            models.Location.description.contains(search)
-            )
-        ).
-        limit(limit).
-        offset(offset)
-    )
-    locations = query.scalars().unique().all()
-    return [schemas.LocationOut.from_orm(location) for location in locations]
+    `fields` and `expand` are comma-separated lists of the columns and
+    relationships to return; everything is returned when they are omitted.
+    """
+
+    try:
+        fields = controllers.parse_list_param(fields, controllers.LOCATION_FIELDS)
+        expand = controllers.parse_list_param(expand, controllers.LOCATION_EXPANSIONS)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'invalid fields or expand: {e}'}
+        )
+
+    if fields is not None:
+        # The keyset cursor is built from these columns
+        fields.update(('created_at', 'id'))
+
+    limit = controllers.get_page_limit(limit)
+    keys = (models.Location.created_at, models.Location.id)
+    statement = sa.select(models.Location)
+
+    if search:
+        columns = (models.Location.name, models.Location.description)
+        relevance = controllers.get_search_relevance(columns, search)
+        statement = (
+            sa.select(models.Location, relevance)
+            .where(controllers.get_search_filter(columns, search))
+        )
+        keys = (relevance, *keys)
+
+    statement = statement.options(*controllers.get_location_out_options(fields, expand))
+
+    try:
+        statement = controllers.paginate(statement, keys, limit, offset, cursor)
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid cursor'}
+        )
+
+    query = await db.execute(statement)
+    rows = query.unique().all()
+    locations = [row[0] for row in rows]
+
+    next_cursor = controllers.get_next_cursor(rows, keys, limit)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+    return [schemas.LocationSparse.from_orm(location) for location in locations]
 
 
 @router.get(
     '/{id}',
-    response_model=schemas.LocationOut,
+    response_model=schemas.LocationSparse,
+    response_model_exclude_unset=True,
     responses={
+        304: {
+            'description': 'The version in If-None-Match is current'
+        },
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid fields or expand'
+        },
         404: {
             'model': schemas.ResponseError,
             'description': 'The location was not found'
@@ -54,11 +110,44 @@ async def get_all_locations(
 )
 async def get_location(
     id: UUID,
-    db: AsyncSession = Depends(database.get_session)
+    request: Request,
+    db: AsyncSession = Depends(database.get_read_session),
+    fields: str | None = None,
+    expand: str | None = None,
 ):
     """Returns the location with the specified id"""
 
-    query = await db.execute(sa.select(models.Location).where(models.Location.id == id))
+    try:
+        fields = controllers.parse_list_param(fields, controllers.LOCATION_FIELDS)
+        expand = controllers.parse_list_param(expand, controllers.LOCATION_EXPANSIONS)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'invalid fields or expand: {e}'}
+        )
+
+    # Revalidation reads only the versions, not the graph of the location. It is
+    # not answered from the response cache, which may lag behind a write
+    # made through another worker.
+    revalidating = 'if-none-match' in request.headers
+    if revalidating:
+        etag = await controllers.get_location_etag(db, id, expand)
+        if etag is not None and controllers.is_etag_matched(request.headers, etag):
+            return controllers.get_not_modified_response(etag)
+
+    cache_key = controllers.get_response_cache_key('location', id, fields, expand)
+    cached = await controllers.response_cache.get(cache_key)
+
+    if cached is not None and (not revalidating or cached.etag == etag):
+        return Response(cached.body, media_type='application/json', headers={'ETag': cached.etag})
+
+    read_started_at = time.time()
+
+    query = await db.execute(
+        sa.select(models.Location)
+        .where(models.Location.id == id)
+        .options(*controllers.get_location_out_options(fields, expand))
+    )
     location = query.scalars().first()
 
     if not location:
@@ -67,7 +156,11 @@ async def get_location(
             content={'status': 404, 'error': f'location with id={id!s} was not found'}
         )
 
-    return schemas.LocationOut.from_orm(location)
+    etag = controllers.get_rendered_location_etag(location)
+    body = schemas.LocationSparse.from_orm(location).json(exclude_unset=True).encode()
+    await controllers.response_cache.put(cache_key, body, etag, controllers.get_location_cache_tags(location), read_started_at)
+
+    return Response(body, media_type='application/json', headers={'ETag': etag})
 
 
 @router.post(
@@ -75,6 +168,10 @@ async def get_location(
     response_model=schemas.LocationCreated,
     status_code=status.HTTP_201_CREATED,
     responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'One of the images does not exist'
+        },
         401: {
             'model': schemas.ResponseError,
             'description': 'Unauthorized'
@@ -92,7 +189,7 @@ async def get_location(
 async def create_location(
     body: schemas.LocationIn,
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Creates a new location"""
 
@@ -114,9 +211,24 @@ async def create_location(
 
     try:
         data = await db.execute(query)
-        await db.commit()
         location = data.scalars().first()
 
+        # Images are written in the same transaction, so a bad image leaves no location behind
+        if images:
+            await controllers.insert_location_images(
+                db,
+                [{**image, 'location_id': location.id} for image in images]
+            )
+
+        await controllers.bump_world_version(db, location.world_id)
+        await db.commit()
+
+    except sa.exc.IntegrityError:
+        await db.rollback()
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid image'}
+        )
     except Exception as e:
         await db.rollback()
         return JSONResponse(
@@ -127,8 +239,8 @@ async def create_location(
             }
         )
 
-    for image in images:
-        await controllers.add_location_image_to_db(db, location.id, image)
+    controllers.add_to_location_indexes(location.world_id, location.id, location.coord_x, location.coord_y)
+    await controllers.response_cache.invalidate(controllers.world_tag(location.world_id))
 
     return schemas.LocationCreated.from_orm(location)
 
@@ -163,7 +275,7 @@ async def update_location(
     id: UUID,
     body: schemas.LocationUpdate,
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Updates the location data with the specified id"""
 
@@ -204,7 +316,7 @@ async def update_location(
         statement = (
             sa.update(models.Location)
             .where(models.Location.id == id)
-            .values(**body.dict(exclude_unset=True))
+            .values(**body.dict(exclude_unset=True), version=models.Location.version + 1)
             .returning(models.Location)
         )
         query = (
@@ -213,10 +325,13 @@ async def update_location(
             .execution_options(populate_existing=True)
         )
         data = await db.execute(query)
+        updated_location = data.scalars().first()
+
+        # The world embeds its locations. Coordinates can not be edited, so the location indexes stay as they are
+        await controllers.bump_world_version(db, updated_location.world_id)
         await db.commit()
+        await controllers.response_cache.invalidate(controllers.location_tag(id))
 
-        updated_location = data.scalars().first()
-        
         return schemas.LocationCreated.from_orm(updated_location)
     except Exception as e:
         await db.rollback()
@@ -254,7 +369,7 @@ async def update_location(
 async def delete_location(
     id: UUID, 
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Deletes the location with the specified id"""
 
@@ -281,7 +396,10 @@ async def delete_location(
 
     try:
         await db.execute(sa.delete(models.Location).where(models.Location.id == id))
+        await controllers.bump_world_version(db, location.world_id)
         await db.commit()
+        controllers.remove_from_location_indexes(location.world_id, id)
+        await controllers.response_cache.invalidate(controllers.location_tag(id))
 
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     except Exception as e:
@@ -301,7 +419,7 @@ async def delete_location(
 )
 async def get_location_images(
     id: UUID,
-    db: AsyncSession = Depends(database.get_session)
+    db: AsyncSession = Depends(database.get_read_session)
 ):
     """Returns a list of images for a specific location"""
 
@@ -324,15 +442,18 @@ async def get_location_images(
         },
     }
 )
-async def add_location_image(
+async def add_location_images(
     id: UUID,
-    image: schemas.LocationImageIn,
+    images: schemas.LocationImageIn | list[schemas.LocationImageIn],
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
-    """Adds an image to a specific location"""
+    """Adds one image or a list of images to a specific location"""
+
+    if not isinstance(images, list):
+        images = [images]
 
-    return await controllers.add_location_image_to_db(db, id, image)
+    return await controllers.add_location_images_to_db(db, id, images)
 
 
 @router.delete(
@@ -352,12 +473,12 @@ async def delete_location_image(
     id: UUID,
     image: str,
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Deletes an image from a location"""
 
     try:
-        await db.execute(
+        result = await db.execute(
             sa.delete(models.LocationImage)
             .where(
                 sa.and_(
@@ -366,7 +487,10 @@ async def delete_location_image(
                 ) 
             )
         )
+        if result.rowcount:
+            await controllers.bump_location_version(db, id)
         await db.commit()
+        await controllers.response_cache.invalidate(controllers.location_tag(id))
     except IntegrityError:
         return JSONResponse(
             status_code=status.HTTP_400_BAD_REQUEST,
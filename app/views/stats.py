@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends
+
+from app import schemas, utils
+from app.controllers import database, oauth2
+
+router = APIRouter(
+    prefix='/stats',
+    tags=['Stats']
+)
+
+
+@router.get(
+    '/database',
+    response_model=list[schemas.DatabasePoolStatus],
+    responses={
+        401: {
+            'model': schemas.ResponseError,
+            'description': 'Unauthorized'
+        },
+    }
+)
+async def get_database_stats(
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
+):
+    """Returns the state and checkout wait times of the worker's primary and replica pools"""
+
+    return database.get_pool_status()
+
+
+@router.get(
+    '/password-hashing',
+    response_model=schemas.PasswordHashStatus,
+    responses={
+        401: {
+            'model': schemas.ResponseError,
+            'description': 'Unauthorized'
+        },
+    }
+)
+async def get_password_hashing_stats(
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
+):
+    """Returns the queue times of the worker's password hashing pool"""
+
+    return utils.password_hash_stats.get_status()
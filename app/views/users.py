@@ -1,11 +1,12 @@
 from uuid import UUID
 
 import sqlalchemy as sa
-from fastapi import APIRouter, Depends, Response, status
+from fastapi import APIRouter, Depends, Request, Response, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import models, schemas, utils
+from app import models, schemas, utils, controllers
+from app.config import config
 from app.controllers import database, oauth2
 
 
@@ -26,8 +27,8 @@ router = APIRouter(
     }
 )
 async def get_mine_user(
-    db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    db: AsyncSession = Depends(database.get_read_session),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Returns the data of the authorized user"""
 
@@ -35,7 +36,11 @@ async def get_mine_user(
     # It may happen when user deletes their account
     # and then tries to request this endpoint
     try:
-        query = await db.execute(sa.select(models.User).where(models.User.id == current_user.id))
+        query = await db.execute(
+            sa.select(models.User)
+            .where(models.User.id == current_user.id)
+            .options(*controllers.get_user_profile_options())
+        )
         user = query.scalars().first()
     except AttributeError:
         return JSONResponse(
@@ -47,32 +52,107 @@ async def get_mine_user(
     return user
 
 
+@router.get(
+    '/me/favourites',
+    response_model=list[UUID],
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid or too many world ids'
+        },
+        401: {
+            'model': schemas.ResponseError,
+            'description': 'Unauthorized'
+        },
+    }
+)
+async def get_mine_favourites(
+    world_ids: str,
+    db: AsyncSession = Depends(database.get_read_session),
+    user_id: UUID = Depends(oauth2.get_optional_user_id)
+):
+    """Returns which of the comma-separated `world_ids` the authorized user has favourited"""
+
+    if user_id is None:
+        return JSONResponse(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            content={'status': 401, 'error': 'not authenticated'},
+            headers={'WWW-Authenticate': 'Bearer'}
+        )
+
+    try:
+        ids = [UUID(world_id.strip()) for world_id in world_ids.split(',') if world_id.strip()]
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid world id'}
+        )
+
+    if len(ids) > config.PAGINATION_MAX_LIMIT:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'at most {config.PAGINATION_MAX_LIMIT} world ids can be passed'}
+        )
+
+    favourites = await controllers.get_favourite_world_ids(db, user_id, ids)
+
+    return [world_id for world_id in ids if world_id in favourites]
+
+
 @router.get(
     '/',
-    response_model=list[schemas.UserOutPublic]
+    response_model=list[schemas.UserOutPublic],
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid pagination cursor'
+        },
+    }
 )
 async def get_all_users(
-    db: AsyncSession = Depends(database.get_session),
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_session),
     search: str | None = None,
     limit: int | None = None,
     offset: int | None = None,
+    cursor: str | None = None,
 ):
     """Returns a list of all users"""
 
-    search = search if search else ''
-    query = await db.execute(
-        sa.select(models.User).
-        where(sa.or_(
-            models.User.first_name.contains(search),
-            models.User.last_name.contains(search),
-            models.User.additional_name.contains(search),
-            models.User.username.contains(search)
-            )
-        ).
-        limit(limit).
-        offset(offset)
-    )
-    users = query.scalars().unique().all()
+    limit = controllers.get_page_limit(limit)
+    keys = (models.User.created_at, models.User.id)
+    statement = sa.select(models.User)
+
+    if search:
+        columns = (
+            models.User.first_name,
+            models.User.last_name,
+            models.User.additional_name,
+            models.User.username
+        )
+        relevance = controllers.get_search_relevance(columns, search)
+        statement = (
+            sa.select(models.User, relevance)
+            .where(controllers.get_search_filter(columns, search))
+        )
+        keys = (relevance, *keys)
+
+    try:
+        statement = controllers.paginate(statement, keys, limit, offset, cursor)
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid cursor'}
+        )
+
+    query = await db.execute(statement)
+    rows = query.unique().all()
+    users = [row[0] for row in rows]
+
+    next_cursor = controllers.get_next_cursor(rows, keys, limit)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
     return [schemas.UserOutPublic.from_orm(user) for user in users]
 
 
@@ -80,6 +160,9 @@ async def get_all_users(
     '/{id}',
     response_model=schemas.UserOutPublic,
     responses={
+        304: {
+            'description': 'The version in If-None-Match is current'
+        },
         404: {
             'model': schemas.ResponseError,
             'description': 'The user was not found'
@@ -88,10 +171,19 @@ async def get_all_users(
 )
 async def get_user(
     id: UUID,
-    db: AsyncSession = Depends(database.get_session)
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_session)
 ):
     """Returns the user with the specified id"""
 
+    if 'if-none-match' in request.headers:
+        version = await controllers.get_version(db, models.User, id)
+        if version is not None:
+            etag = controllers.get_version_etag(version)
+            if controllers.is_etag_matched(request.headers, etag):
+                return controllers.get_not_modified_response(etag)
+
     query = await db.execute(sa.select(models.User).where(models.User.id == id))
     user = query.scalars().first()
 
@@ -101,6 +193,8 @@ async def get_user(
             content={'status': 404, 'error': f'user with id={id!s} was not found'}
         )
 
+    response.headers['ETag'] = controllers.get_version_etag(user.version)
+
     return schemas.UserOutPublic.from_orm(user)
 
 
@@ -117,19 +211,19 @@ async def get_user(
 async def update_user(
     body: schemas.UserUpdate,
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Updates the account of an authorized user"""
 
     try:
         if body.password is not None:
-            hashed_password = utils.get_password_hash(body.password)
+            hashed_password = await utils.hash_password(body.password)
             body.password = hashed_password
 
         statement = (
             sa.update(models.User)
             .where(models.User.id == current_user.id)
-            .values(**body.dict(exclude_unset=True))
+            .values(**body.dict(exclude_unset=True), version=models.User.version + 1)
             .returning(models.User)
         )
         query = (
@@ -139,6 +233,8 @@ async def update_user(
         )
         data = await db.execute(query)
         await db.commit()
+        oauth2.principal_cache.discard(current_user.id)
+        await controllers.response_cache.invalidate(controllers.user_tag(current_user.id))
 
         updated_user = data.scalars().first()
         
@@ -176,7 +272,7 @@ async def update_user(
 async def delete_user(
     id: UUID, 
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Deletes the user with the specified id"""
 
@@ -197,6 +293,8 @@ async def delete_user(
     try:
         await db.execute(sa.delete(models.User).where(models.User.id == id))
         await db.commit()
+        oauth2.principal_cache.discard(id)
+        await controllers.response_cache.invalidate(controllers.user_tag(id))
 
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     except Exception as e:
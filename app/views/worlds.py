@@ -1,12 +1,14 @@
-from uuid import UUID
+import time
+from uuid import UUID, uuid4
 
 import sqlalchemy as sa
-from fastapi import APIRouter, Depends, Response, status
+from fastapi import APIRouter, Depends, Request, Response, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.dialects.postgresql import insert as psql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app import models, schemas
+from app import models, schemas, controllers
+from app.config import config
 from app.controllers import database, oauth2
 
 
@@ -16,37 +18,143 @@ router = APIRouter(
 )
 
 
+async def get_worlds_out(
+    db: AsyncSession,
+    worlds: list[models.World],
+    user_id: UUID | None
+) -> list[schemas.WorldSparse]:
+    """Renders a page of worlds, with `is_favourite` when the user is known"""
+
+    worlds_out = [schemas.WorldSparse.from_orm(world) for world in worlds]
+
+    if user_id is not None:
+        favourites = await controllers.get_favourite_world_ids(db, user_id, [world.id for world in worlds])
+
+        for world_out in worlds_out:
+            world_out.is_favourite = world_out.id in favourites
+
+    return worlds_out
+
+
 @router.get(
     '/',
-    response_model=list[schemas.WorldOut]
+    response_model=list[schemas.WorldSparse],
+    response_model_exclude_unset=True,
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid pagination cursor, fields or expand'
+        },
+    }
 )
 async def get_all_worlds(
-    db: AsyncSession = Depends(database.get_session),
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_session),
+    user_id: UUID | None = Depends(oauth2.get_optional_user_id),
     search: str | None = None,
     limit: int | None = None,
     offset: int | None = None,
+    cursor: str | None = None,
+    fields: str | None = None,
+    expand: str | None = None,
 ):
-    """Returns a list of all worlds"""
+    """Returns a list of all worlds.
+
+    `fields` and `expand` are comma-separated lists of the columns and
+    relationships to return; everything is returned when they are omitted.
+    Authorized requests also get `is_favourite` for every world.
+    """
+
+    try:
+        fields = controllers.parse_list_param(fields, controllers.WORLD_FIELDS)
+        expand = controllers.parse_list_param(expand, controllers.WORLD_EXPANSIONS)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'invalid fields or expand: {e}'}
+        )
+
+    if fields is not None:
+        # The keyset cursor is built from these columns
+        fields.update(('created_at', 'id'))
+
+    limit = controllers.get_page_limit(limit)
+    keys = (models.World.created_at, models.World.id)
+    statement = sa.select(models.World)
+
+    if search:
+        columns = (models.World.name, models.World.description)
+        relevance = controllers.get_search_relevance(columns, search)
+        statement = (
+            sa.select(models.World, relevance)
+            .where(controllers.get_search_filter(columns, search))
+        )
+        keys = (relevance, *keys)
+
+    statement = statement.options(*controllers.get_world_out_options(fields, expand))
+
+    try:
+        statement = controllers.paginate(statement, keys, limit, offset, cursor)
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid cursor'}
+        )
+
+    query = await db.execute(statement)
+    rows = query.unique().all()
+    worlds = [row[0] for row in rows]
+
+    next_cursor = controllers.get_next_cursor(rows, keys, limit)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+    return await get_worlds_out(db, worlds, user_id)
+
+
+@router.get(
+    '/popular',
+    response_model=list[schemas.WorldSparse],
+    response_model_exclude_unset=True
+)
+async def get_popular_worlds(
+    db: AsyncSession = Depends(database.get_read_session),
+    user_id: UUID | None = Depends(oauth2.get_optional_user_id),
+    limit: int | None = None,
+):
+    """Returns the most popular worlds, ranked by recently added favourites.
+
+    The ranking is recomputed in the background every few minutes.
+    """
+
+    world_ids = await controllers.get_popular_world_ids()
+    world_ids = world_ids[:controllers.get_page_limit(limit)]
+
+    if not world_ids:
+        return []
 
-    search = search if search else ''
     query = await db.execute(
         sa.select(models.World)
-        .where(sa.or_(
-            models.World.name.contains(search),
-            models.World.description.contains(search)
-            )
-        )
-        .limit(limit)
-        .offset(offset)
+        .where(models.World.id.in_(world_ids))
+        .options(*controllers.get_world_out_options(expand={'creator'}))
     )
-    worlds = query.scalars().unique().all()
-    return [schemas.WorldOut.from_orm(world) for world in worlds]
+    worlds = {world.id: world for world in query.scalars()}
+
+    return await get_worlds_out(db, [worlds[id] for id in world_ids if id in worlds], user_id)
 
 
 @router.get(
     '/{id}',
-    response_model=schemas.WorldOut,
+    response_model=schemas.WorldSparse,
+    response_model_exclude_unset=True,
     responses={
+        304: {
+            'description': 'The version in If-None-Match is current'
+        },
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid fields or expand'
+        },
         404: {
             'model': schemas.ResponseError,
             'description': 'The world was not found'
@@ -55,11 +163,44 @@ async def get_all_worlds(
 )
 async def get_world(
     id: UUID,
-    db: AsyncSession = Depends(database.get_session)
+    request: Request,
+    db: AsyncSession = Depends(database.get_read_session),
+    fields: str | None = None,
+    expand: str | None = None,
 ):
     """Returns the world with the specified id"""
 
-    query = await db.execute(sa.select(models.World).where(models.World.id == id))
+    try:
+        fields = controllers.parse_list_param(fields, controllers.WORLD_FIELDS)
+        expand = controllers.parse_list_param(expand, controllers.WORLD_EXPANSIONS)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'invalid fields or expand: {e}'}
+        )
+
+    # Revalidation reads only the versions, not the graph of the world. It is
+    # not answered from the response cache, which may lag behind a write
+    # made through another worker.
+    revalidating = 'if-none-match' in request.headers
+    if revalidating:
+        etag = await controllers.get_world_etag(db, id, expand)
+        if etag is not None and controllers.is_etag_matched(request.headers, etag):
+            return controllers.get_not_modified_response(etag)
+
+    cache_key = controllers.get_response_cache_key('world', id, fields, expand)
+    cached = await controllers.response_cache.get(cache_key)
+
+    if cached is not None and (not revalidating or cached.etag == etag):
+        return Response(cached.body, media_type='application/json', headers={'ETag': cached.etag})
+
+    read_started_at = time.time()
+
+    query = await db.execute(
+        sa.select(models.World)
+        .where(models.World.id == id)
+        .options(*controllers.get_world_out_options(fields, expand))
+    )
     world = query.scalars().first()
 
     if not world:
@@ -68,7 +209,296 @@ async def get_world(
             content={'status': 404, 'error': f'world with id={id!s} was not found'}
         )
 
-    return schemas.WorldOut.from_orm(world)
+    etag = controllers.get_rendered_world_etag(world)
+    body = schemas.WorldSparse.from_orm(world).json(exclude_unset=True).encode()
+    await controllers.response_cache.put(cache_key, body, etag, controllers.get_world_cache_tags(world), read_started_at)
+
+    return Response(body, media_type='application/json', headers={'ETag': etag})
+
+
+@router.get(
+    '/{id}/clusters',
+    response_model=list[schemas.LocationCluster],
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid bbox'
+        },
+        404: {
+            'model': schemas.ResponseError,
+            'description': 'The world was not found'
+        },
+    }
+)
+async def get_world_clusters(
+    id: UUID,
+    response: Response,
+    zoom: int = 0,
+    bbox: str | None = None,
+    db: AsyncSession = Depends(database.get_read_session),
+):
+    """Returns the location clusters of the world map at the zoom level, optionally only inside `bbox`.
+
+    Too many clusters are merged by stepping to a coarser zoom level, the
+    one used is in the X-Cluster-Zoom header.
+    """
+
+    try:
+        bbox = controllers.parse_bbox(bbox) if bbox is not None else None
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'invalid bbox: {e}'}
+        )
+
+    if controllers.location_clusters.peek(id) is None:
+        query = await db.execute(sa.select(models.World.id).where(models.World.id == id))
+
+        if query.scalar() is None:
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={'status': 404, 'error': f'world with id={id!s} was not found'}
+            )
+
+    zoom, clusters = await controllers.get_world_clusters(db, id, zoom, bbox)
+    response.headers['X-Cluster-Zoom'] = str(zoom)
+
+    return [schemas.LocationCluster(**cluster) for cluster in clusters]
+
+
+@router.get(
+    '/{id}/locations/nearest',
+    response_model=list[schemas.LocationSparse],
+    response_model_exclude_unset=True,
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid fields or expand'
+        },
+        404: {
+            'model': schemas.ResponseError,
+            'description': 'The world was not found'
+        },
+    }
+)
+async def get_nearest_locations(
+    id: UUID,
+    x: float,
+    y: float,
+    k: int = 10,
+    db: AsyncSession = Depends(database.get_read_session),
+    fields: str | None = None,
+    expand: str | None = None,
+):
+    """Returns the k locations of the world closest to the point (x, y), nearest first"""
+
+    try:
+        fields = controllers.parse_list_param(fields, controllers.LOCATION_FIELDS)
+        expand = controllers.parse_list_param(expand, controllers.LOCATION_EXPANSIONS)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'invalid fields or expand: {e}'}
+        )
+
+    if controllers.location_index.peek(id) is None:
+        query = await db.execute(sa.select(models.World.id).where(models.World.id == id))
+
+        if query.scalar() is None:
+            return JSONResponse(
+                status_code=status.HTTP_404_NOT_FOUND,
+                content={'status': 404, 'error': f'world with id={id!s} was not found'}
+            )
+
+    k = controllers.get_page_limit(k)
+    ids = await controllers.get_nearest_location_ids(db, id, x, y, k)
+
+    query = await db.execute(
+        sa.select(models.Location)
+        .where(models.Location.id.in_(ids))
+        .options(*controllers.get_location_out_options(fields, expand))
+    )
+    locations = {location.id: location for location in query.scalars().unique().all()}
+
+    return [schemas.LocationSparse.from_orm(locations[i]) for i in ids if i in locations]
+
+
+@router.get(
+    '/{id}/locations',
+    response_model=list[schemas.LocationSparse],
+    response_model_exclude_unset=True,
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Invalid bbox, pagination cursor, fields or expand'
+        },
+        404: {
+            'model': schemas.ResponseError,
+            'description': 'The world was not found'
+        },
+    }
+)
+async def get_world_locations(
+    id: UUID,
+    response: Response,
+    db: AsyncSession = Depends(database.get_read_session),
+    bbox: str | None = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    fields: str | None = None,
+    expand: str | None = None,
+):
+    """Returns the locations of the world, optionally only those inside `bbox=x1,y1,x2,y2`"""
+
+    try:
+        bbox = controllers.parse_bbox(bbox) if bbox is not None else None
+        fields = controllers.parse_list_param(fields, controllers.LOCATION_FIELDS)
+        expand = controllers.parse_list_param(expand, controllers.LOCATION_EXPANSIONS)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'invalid query parameters: {e}'}
+        )
+
+    query = await db.execute(sa.select(models.World.id).where(models.World.id == id))
+
+    if query.scalar() is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={'status': 404, 'error': f'world with id={id!s} was not found'}
+        )
+
+    if fields is not None:
+        # The keyset cursor is built from these columns
+        fields.update(('created_at', 'id'))
+
+    limit = controllers.get_page_limit(limit)
+    keys = (models.Location.created_at, models.Location.id)
+    statement = (
+        sa.select(models.Location)
+        .where(models.Location.world_id == id)
+        .options(*controllers.get_location_out_options(fields, expand))
+    )
+
+    if bbox is not None:
+        statement = statement.where(controllers.get_bbox_filter(bbox))
+
+    try:
+        statement = controllers.paginate(statement, keys, limit, cursor=cursor)
+    except ValueError:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid cursor'}
+        )
+
+    query = await db.execute(statement)
+    locations = query.scalars().unique().all()
+
+    next_cursor = controllers.get_next_cursor(locations, keys, limit)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = next_cursor
+
+    return [schemas.LocationSparse.from_orm(location) for location in locations]
+
+
+@router.post(
+    '/{id}/locations/batch',
+    response_model=schemas.LocationBatchCreated,
+    status_code=status.HTTP_201_CREATED,
+    responses={
+        400: {
+            'model': schemas.ResponseError,
+            'description': 'Too many locations, a location of another world or an unknown image'
+        },
+        401: {
+            'model': schemas.ResponseError,
+            'description': 'Unauthorized'
+        },
+        404: {
+            'model': schemas.ResponseError,
+            'description': 'The world was not found'
+        },
+        500: {
+            'model': schemas.ResponseError,
+            'description': 'Internal server error'
+        },
+    }
+)
+async def create_locations_batch(
+    id: UUID,
+    body: list[schemas.LocationIn],
+    db: AsyncSession = Depends(database.get_session),
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
+):
+    """Creates many locations of a world in one transaction.
+
+    Returns the ids of the created locations in the order of the body.
+    """
+
+    if len(body) > config.LOCATION_BATCH_MAX_SIZE:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'at most {config.LOCATION_BATCH_MAX_SIZE} locations can be created at once'}
+        )
+
+    if any(location.world_id != id for location in body):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': f'every location must have world_id={id!s}'}
+        )
+
+    query = await db.execute(sa.select(models.World.id).where(models.World.id == id))
+
+    if query.scalar() is None:
+        return JSONResponse(
+            status_code=status.HTTP_404_NOT_FOUND,
+            content={'status': 404, 'error': f'world with id={id!s} was not found'}
+        )
+
+    if not body:
+        return schemas.LocationBatchCreated(ids=[])
+
+    locations = []
+    images = []
+
+    for location in body:
+        # Ids are generated here so they come back in the order of the body
+        location_id = uuid4()
+        locations.append({
+            **location.dict(exclude={'images'}),
+            'id': location_id,
+            'creator_id': current_user.id
+        })
+        images.extend({**image.dict(), 'location_id': location_id} for image in location.images)
+
+    try:
+        await controllers.insert_locations(db, locations)
+        if images:
+            await controllers.insert_location_images(db, images)
+        await controllers.bump_world_version(db, id)
+        await db.commit()
+    except sa.exc.IntegrityError:
+        await db.rollback()
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content={'status': 400, 'error': 'invalid image'}
+        )
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            content={
+                'status': 500,
+                'error': f'something went wrong: {e}'
+            }
+        )
+
+    for location in locations:
+        controllers.add_to_location_indexes(id, location['id'], location['coord_x'], location['coord_y'])
+
+    await controllers.response_cache.invalidate(controllers.world_tag(id))
+
+    return schemas.LocationBatchCreated(ids=[location['id'] for location in locations])
 
 
 @router.post(
@@ -89,6 +519,7 @@ async def get_world(
 async def create_world(
     body: schemas.WorldIn,
     db: AsyncSession = Depends(database.get_session),
+    # The ORM user is needed: WorldCreated renders the creator from the session
     current_user: models.User = Depends(oauth2.get_current_user)
 ):
     """Creates a new world"""
@@ -101,6 +532,7 @@ async def create_world(
 
     try:
         await db.commit()
+        await controllers.schedule_tile_pyramid(world.map_image)
         return schemas.WorldCreated.from_orm(world)
     except Exception as e:
         await db.rollback()
@@ -143,6 +575,7 @@ async def update_world(
     id: UUID,
     body: schemas.WorldUpdate,
     db: AsyncSession = Depends(database.get_session),
+    # The ORM user is needed: WorldCreated renders the creator from the session
     current_user: models.User = Depends(oauth2.get_current_user)
 ):
     """Updates the world data with the specified id"""
@@ -184,7 +617,7 @@ async def update_world(
         statement = (
             sa.update(models.World)
             .where(models.World.id == id)
-            .values(**body.dict(exclude_unset=True))
+            .values(**body.dict(exclude_unset=True), version=models.World.version + 1)
             .returning(models.World)
         )
         query = (
@@ -194,9 +627,15 @@ async def update_world(
         )
         data = await db.execute(query)
         await db.commit()
+        await controllers.response_cache.invalidate(controllers.world_tag(id))
 
         updated_world = data.scalars().first()
-        
+
+        if body.map_image is not None:
+            await controllers.schedule_tile_pyramid(updated_world.map_image)
+            # Clusters span the map image
+            controllers.discard_location_indexes(id)
+
         return schemas.WorldCreated.from_orm(updated_world)
     except Exception as e:
         await db.rollback()
@@ -234,7 +673,7 @@ async def update_world(
 async def delete_world(
     id: UUID, 
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Deletes the world with the specified id"""
 
@@ -262,6 +701,8 @@ async def delete_world(
     try:
         await db.execute(sa.delete(models.World).where(models.World.id == id))
         await db.commit()
+        controllers.discard_location_indexes(id)
+        await controllers.response_cache.invalidate(controllers.world_tag(id))
 
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     except Exception as e:
@@ -296,16 +737,23 @@ async def delete_world(
 async def favourite_world(
     id: UUID,
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Adds a world to favorites"""
 
     insert_stmt = psql_insert(models.FavouriteWorld).values(world_id=id, user_id=current_user.id)
-    query = insert_stmt.on_conflict_do_nothing(index_elements=['world_id', 'user_id'])
+    query = (
+        insert_stmt
+        .on_conflict_do_nothing(index_elements=['world_id', 'user_id'])
+        .returning(models.FavouriteWorld.world_id)
+    )
 
     try:
-        await db.execute(query)
+        data = await db.execute(query)
+        if data.scalar() is not None:
+            await controllers.increment_favourite_count(db, id, 1)
         await db.commit()
+        await controllers.response_cache.invalidate(controllers.world_tag(id))
 
         return Response(status_code=status.HTTP_201_CREATED)
     except sa.exc.IntegrityError:
@@ -344,12 +792,12 @@ async def favourite_world(
 async def unfavourite_world(
     id: UUID, 
     db: AsyncSession = Depends(database.get_session),
-    current_user: models.User = Depends(oauth2.get_current_user)
+    current_user: oauth2.Principal = Depends(oauth2.get_current_principal)
 ):
     """Deletes a world from favourites"""
 
     try:
-        await db.execute(
+        data = await db.execute(
             sa.delete(models.FavouriteWorld)
             .where(
                 sa.and_(
@@ -357,8 +805,12 @@ async def unfavourite_world(
                 models.FavouriteWorld.user_id == current_user.id
                 )
             )
+            .returning(models.FavouriteWorld.world_id)
         )
+        if data.scalar() is not None:
+            await controllers.increment_favourite_count(db, id, -1)
         await db.commit()
+        await controllers.response_cache.invalidate(controllers.world_tag(id))
 
         return Response(status_code=status.HTTP_204_NO_CONTENT)
     except Exception as e:
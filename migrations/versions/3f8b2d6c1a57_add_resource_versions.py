@@ -0,0 +1,28 @@
+"""add resource versions
+
+Revision ID: 3f8b2d6c1a57
+Revises: e2c8a4f61b90
+Create Date: 2026-10-17 16:42:08.519347
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8b2d6c1a57'
+down_revision = 'e2c8a4f61b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('worlds', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('locations', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('users', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+
+
+def downgrade():
+    op.drop_column('users', 'version')
+    op.drop_column('locations', 'version')
+    op.drop_column('worlds', 'version')
@@ -0,0 +1,30 @@
+"""add file content hash
+
+Revision ID: 5e7a1c9d0b84
+Revises: c4f0e9b27d15
+Create Date: 2026-10-17 13:02:41.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e7a1c9d0b84'
+down_revision = 'c4f0e9b27d15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('files', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.add_column('files', sa.Column('size', sa.BigInteger(), nullable=True))
+    op.add_column('files', sa.Column('ref_count', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.create_index(op.f('ix_files_sha256'), 'files', ['sha256'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_files_sha256'), table_name='files')
+    op.drop_column('files', 'ref_count')
+    op.drop_column('files', 'size')
+    op.drop_column('files', 'sha256')
@@ -0,0 +1,25 @@
+"""add file last uploaded at
+
+Revision ID: 8c1e5a0f7d23
+Revises: 3f8b2d6c1a57
+Create Date: 2026-10-17 18:05:37.204118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c1e5a0f7d23'
+down_revision = '3f8b2d6c1a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('files', sa.Column('last_uploaded_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'), nullable=False))
+    op.execute('UPDATE files SET last_uploaded_at = uploaded_at')
+
+
+def downgrade():
+    op.drop_column('files', 'last_uploaded_at')
@@ -0,0 +1,28 @@
+"""add file reference indexes
+
+Revision ID: 9d4b6e2a7f13
+Revises: 5e7a1c9d0b84
+Create Date: 2026-10-17 13:41:09.204617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4b6e2a7f13'
+down_revision = '5e7a1c9d0b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_worlds_map_image'), 'worlds', ['map_image'], unique=False)
+    op.create_index(op.f('ix_worlds_cover_image'), 'worlds', ['cover_image'], unique=False)
+    op.create_index(op.f('ix_users_avatar_image'), 'users', ['avatar_image'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_users_avatar_image'), table_name='users')
+    op.drop_index(op.f('ix_worlds_cover_image'), table_name='worlds')
+    op.drop_index(op.f('ix_worlds_map_image'), table_name='worlds')
@@ -0,0 +1,46 @@
+"""add trigram search indexes
+
+Revision ID: a81c5e0d6f32
+Revises: 3b9d2f7c1e4a
+Create Date: 2026-10-17 11:02:47.918305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a81c5e0d6f32'
+down_revision = '3b9d2f7c1e4a'
+branch_labels = None
+depends_on = None
+
+
+TRGM_INDEXES = (
+    ('worlds', 'name'),
+    ('worlds', 'description'),
+    ('locations', 'name'),
+    ('locations', 'description'),
+    ('users', 'first_name'),
+    ('users', 'last_name'),
+    ('users', 'additional_name'),
+    ('users', 'username'),
+)
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in TRGM_INDEXES:
+        op.create_index(
+            f'ix_{table}_{column}_trgm',
+            table,
+            [column],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={column: 'gin_trgm_ops'}
+        )
+
+
+def downgrade():
+    for table, column in reversed(TRGM_INDEXES):
+        op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
@@ -0,0 +1,24 @@
+"""drop file ref count
+
+Revision ID: b47d3e9a2c61
+Revises: 8c1e5a0f7d23
+Create Date: 2026-10-17 18:31:12.640953
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b47d3e9a2c61'
+down_revision = '8c1e5a0f7d23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_column('files', 'ref_count')
+
+
+def downgrade():
+    op.add_column('files', sa.Column('ref_count', sa.Integer(), server_default=sa.text('1'), nullable=False))
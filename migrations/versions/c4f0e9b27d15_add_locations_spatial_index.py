@@ -0,0 +1,31 @@
+"""add locations spatial index
+
+Revision ID: c4f0e9b27d15
+Revises: a81c5e0d6f32
+Create Date: 2026-10-17 12:26:05.331870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f0e9b27d15'
+down_revision = 'a81c5e0d6f32'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.create_index(
+        'ix_locations_world_id_point',
+        'locations',
+        ['world_id', sa.text('point(coord_x, coord_y)')],
+        unique=False,
+        postgresql_using='gist'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_locations_world_id_point', table_name='locations')
@@ -0,0 +1,36 @@
+"""add world favourite count
+
+Revision ID: e2c8a4f61b90
+Revises: 9d4b6e2a7f13
+Create Date: 2026-10-17 14:10:52.773120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2c8a4f61b90'
+down_revision = '9d4b6e2a7f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('worlds', sa.Column('favourite_count', sa.Integer(), server_default=sa.text('0'), nullable=False))
+    op.execute(
+        'UPDATE worlds SET favourite_count = counts.count '
+        'FROM (SELECT world_id, count(*) AS count FROM favourite_worlds GROUP BY world_id) AS counts '
+        'WHERE worlds.id = counts.world_id'
+    )
+    op.create_index(op.f('ix_worlds_favourite_count'), 'worlds', ['favourite_count'], unique=False)
+
+    op.add_column('favourite_worlds', sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('NOW()'), nullable=False))
+    op.create_index(op.f('ix_favourite_worlds_created_at'), 'favourite_worlds', ['created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_favourite_worlds_created_at'), table_name='favourite_worlds')
+    op.drop_column('favourite_worlds', 'created_at')
+    op.drop_index(op.f('ix_worlds_favourite_count'), table_name='worlds')
+    op.drop_column('worlds', 'favourite_count')